@@ -0,0 +1,58 @@
+"""Data for the benchmarks.
+
+The benchmarks use pytest-benchmark. Run them, and save the results as
+JSON in .benchmarks/, with::
+
+  $ pytest benchmarks/ --benchmark-autosave
+
+Saved runs, for example from two releases, are compared with::
+
+  $ pytest-benchmark compare 0001 0002
+
+Sizes above 10^4 lines or 10^6 spectrum points are only used if the
+option --bench-full is given.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+NLINES = [10, 100, 1000, 10000, 50000]
+NPOINTS = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+
+
+def pytest_addoption(parser):
+    parser.addoption("--bench-full", action="store_true", default=False,
+                     help="Benchmark the largest line lists and spectra.")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--bench-full"):
+        return
+    skip = pytest.mark.skip(reason="needs --bench-full")
+    for item in items:
+        params = getattr(item, "callspec", None)
+        params = params.params if params else {}
+        if params.get("nlines", 0) > 10000 or \
+                params.get("npoints", 0) > 10 ** 6:
+            item.add_marker(skip)
+
+
+def make_spectrum(npoints):
+    """Wave lengths from 3000 to 9000 and a noisy flux."""
+    wave = np.linspace(3000.0, 9000.0, npoints)
+    flux = np.random.RandomState(seed=123).normal(size=npoints)
+    return wave, flux
+
+
+def make_lines(nlines):
+    """Random line wave lengths within the spectrum, with labels.
+
+    Labels repeat, as in real line lists, so that unique labels have
+    to be created.
+    """
+    rs = np.random.RandomState(seed=456)
+    line_wave = np.sort(rs.uniform(3000.0, 9000.0, nlines))
+    ions = ['H I', 'He I', 'C IV', 'N V', 'O III', 'Si II', 'Fe II']
+    labels = [ions[i % len(ions)] for i in range(nlines)]
+    return line_wave, labels
@@ -0,0 +1,32 @@
+"""Benchmark of the time taken to import lineid_plot.
+
+Run with::
+
+  $ pytest benchmarks/test_bench_import.py
+
+Each round starts a new interpreter, since a module is imported only
+once per process. The time of an interpreter that only imports numpy
+is recorded too, so that the cost of lineid_plot itself can be seen.
+"""
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+IMPORT_LINEID_PLOT = (
+    "import sys, lineid_plot; "
+    "assert 'matplotlib.pyplot' not in sys.modules")
+
+
+def _run(code):
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_import_numpy(benchmark):
+    benchmark.pedantic(_run, args=("import numpy",), rounds=10)
+
+
+def test_import_lineid_plot(benchmark):
+    benchmark.pedantic(_run, args=(IMPORT_LINEID_PLOT,), rounds=10)
@@ -0,0 +1,43 @@
+"""Benchmarks of the layout functions, without drawing."""
+import numpy as np
+import pytest
+from conftest import NLINES, make_lines
+
+import lineid_plot
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+@pytest.mark.parametrize("backend", ["numpy", "python", "numba"])
+def test_adjust_boxes(benchmark, nlines, backend):
+    if backend == "python" and nlines > 1000:
+        pytest.skip("The reference loop is too slow for large lists.")
+    if backend == "numba":
+        pytest.importorskip("numba")
+        # Compile before timing.
+        lineid_plot.adjust_boxes([1.0, 2.0], [1.0, 1.0], 0.0, 3.0,
+                                 backend=backend)
+    line_wave, _ = make_lines(nlines)
+    box_widths = np.full(nlines, 6000.0 / nlines)
+    benchmark(lineid_plot.adjust_boxes, line_wave, box_widths, 3000.0,
+              9000.0, max_iter=100, backend=backend)
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+def test_place_boxes(benchmark, nlines):
+    line_wave, _ = make_lines(nlines)
+    box_widths = np.full(nlines, 6000.0 / nlines)
+    benchmark(lineid_plot.place_boxes, line_wave, box_widths, 3000.0, 9000.0)
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+def test_unique_labels(benchmark, nlines):
+    _, labels = make_lines(nlines)
+    benchmark(lineid_plot.unique_labels, labels)
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+def test_layout_labels(benchmark, nlines):
+    from lineid_plot.layout import layout_labels
+    line_wave, labels = make_lines(nlines)
+    benchmark(layout_labels, line_wave, labels, (3000.0, 9000.0), 800.0,
+              layout="exact")
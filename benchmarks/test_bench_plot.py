@@ -0,0 +1,70 @@
+"""Benchmarks of plotting and rendering labelled spectra."""
+import io
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+from conftest import NLINES, NPOINTS, make_lines, make_spectrum  # noqa: E402
+from matplotlib import pyplot as plt  # noqa: E402
+
+import lineid_plot  # noqa: E402
+from lineid_plot import utils  # noqa: E402
+
+
+def _plot(wave, flux, line_wave, labels, **kwargs):
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, labels,
+                                        draw=False, **kwargs)
+    return fig, ax
+
+
+def _render(wave, flux, line_wave, labels, **kwargs):
+    """Plot and save as PNG, which draws the figure."""
+    fig, ax = _plot(wave, flux, line_wave, labels, **kwargs)
+    fig.savefig(io.BytesIO(), format="png")
+    plt.close(fig)
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+def test_render_lines(benchmark, nlines):
+    wave, flux = make_spectrum(10 ** 4)
+    line_wave, labels = make_lines(nlines)
+    benchmark.pedantic(_render, args=(wave, flux, line_wave, labels),
+                       rounds=3)
+
+
+@pytest.mark.parametrize("npoints", NPOINTS)
+def test_render_points(benchmark, npoints):
+    wave, flux = make_spectrum(npoints)
+    line_wave, labels = make_lines(100)
+    benchmark.pedantic(_render, args=(wave, flux, line_wave, labels),
+                       kwargs=dict(decimate=True), rounds=3)
+
+
+@pytest.mark.parametrize("nlines", NLINES)
+def test_get_box_loc(benchmark, nlines):
+    wave, flux = make_spectrum(10 ** 3)
+    line_wave, labels = make_lines(nlines)
+    fig, ax = lineid_plot.prepare_axes(wave, flux)
+    arrow_tip = np.full(nlines, ax.get_ybound()[1])
+    benchmark(lineid_plot.get_box_loc, fig, ax, line_wave, arrow_tip)
+    plt.close(fig)
+
+
+@pytest.mark.parametrize("nlines", [10, 100, 1000, 10000])
+def test_utils_lookups(benchmark, nlines):
+    wave, flux = make_spectrum(10 ** 3)
+    line_wave, labels = make_lines(nlines)
+    fig, ax = _plot(wave, flux, line_wave, labels)
+    benchmark(utils.get_boxes_and_lines, ax, labels)
+    plt.close(fig)
+
+
+@pytest.mark.parametrize("nlines", [10, 100, 1000, 10000])
+def test_utils_style_labels(benchmark, nlines):
+    wave, flux = make_spectrum(10 ** 3)
+    line_wave, labels = make_lines(nlines)
+    fig, ax = _plot(wave, flux, line_wave, labels)
+    colors = ["r"] * nlines
+    benchmark(utils.style_labels, ax, labels, color=colors, linecolor=colors)
+    plt.close(fig)
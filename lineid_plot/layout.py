@@ -0,0 +1,162 @@
+"""Label layout computed from font metrics, without any figures.
+
+The functions here find the same box locations as `plot_line_ids`, for
+a given size and data range of the Axes, but only use the font files
+and the FreeType metrics used by the Agg backend. So they can be used
+in processes that never create a figure; `matplotlib.pyplot` is not
+imported.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+
+__all__ = ['estimate_text_widths', 'layout_labels']
+
+
+def estimate_text_widths(labels, fontsize=12, rotation=90,
+                         fontproperties=None, dpi=100.0, linespacing=1.2):
+    """Width of labels along the x axis, in pixels.
+
+    Parameters
+    ----------
+    labels: list of strings
+        Label texts. Text between pairs of $ signs is treated as
+        mathtext.
+    fontsize: float or list of floats
+        Font size in points, either one for all labels or one for each
+        label.
+    rotation: float
+        Rotation of the labels in degrees. The default, 90, is the
+        rotation used by `plot_line_ids`.
+    fontproperties: FontProperties, dict or None
+        Font of the labels. A dict is passed as keywords to
+        `matplotlib.font_manager.FontProperties`. The size is taken
+        from `fontsize`.
+    dpi: float
+        Dots per inch of the figure that the layout is meant for.
+    linespacing: float
+        Spacing of lines in labels with more than one line, as a
+        multiple of the height of a line. See Notes.
+
+    Returns
+    -------
+    widths: array of floats
+        Width of the bounding box of each label.
+
+    Notes
+    -----
+    The extent of each line of text is measured with the font metrics
+    of the Agg renderer, and rotated bounding boxes are calculated as
+    done by Matplotlib. Widths of single line labels usually agree with
+    those measured from a drawn figure to within a pixel, but can differ
+    for unusual fonts and for TeX labels, which are measured as
+    mathtext.
+
+    Labels with more than one line are approximate: each extra line adds
+    `linespacing` times the height of "lp", while the spacing used by
+    `Text` depends on the version of Matplotlib and on the ascent and
+    descent tables of the font. The estimate can be a few pixels too
+    small per extra line.
+
+    """
+    from matplotlib.backends.backend_agg import RendererAgg
+    from matplotlib.cbook import is_math_text
+    from matplotlib.font_manager import FontProperties
+
+    if fontproperties is None:
+        fontproperties = FontProperties()
+    elif isinstance(fontproperties, dict):
+        fontproperties = FontProperties(**fontproperties)
+    sizes = np.broadcast_to(np.asarray(fontsize, dtype=float), (len(labels),))
+
+    renderer = RendererAgg(1, 1, dpi)
+    theta = np.deg2rad(rotation)
+    cos, sin = abs(np.cos(theta)), abs(np.sin(theta))
+
+    measured = {}
+    widths = np.empty(len(labels))
+    for i, (label, size) in enumerate(zip(labels, sizes.tolist())):
+        key = (label, size)
+        if key not in measured:
+            prop = fontproperties.copy()
+            prop.set_size(size)
+            # Every line is at least as high as "lp", as in Text.
+            _, lp_h, _ = renderer.get_text_width_height_descent(
+                "lp", prop, False)
+            w = h = 0.0
+            lines = label.split("\n")
+            for line in lines:
+                lw, lh, _ = renderer.get_text_width_height_descent(
+                    line, prop, is_math_text(line))
+                w = max(w, lw)
+                h = max(h, lh, lp_h)
+            h += (len(lines) - 1) * linespacing * lp_h
+            measured[key] = w * cos + h * sin
+        widths[i] = measured[key]
+    return widths
+
+
+def layout_labels(line_wave, labels, xlim, axes_width, fontsize=12,
+                  rotation=90, fontproperties=None, dpi=100.0, edges=None,
+                  initial=None, **kwargs):
+    """Locations of label boxes for an Axes of given size and limits.
+
+    Parameters
+    ----------
+    line_wave: list or array of floats
+        Wave length of features to be labelled.
+    labels: list of strings
+        Label text for each line.
+    xlim: (float, float)
+        Limits of the x axis, in data units. The x axis must be
+        linear.
+    axes_width: float
+        Width of the Axes in pixels.
+    fontsize, rotation, fontproperties, dpi:
+        Font and resolution of the labels; see `estimate_text_widths`.
+    edges: (float, float)
+        Range within which the boxes are placed, in data units. The
+        default is `xlim`. `plot_line_ids` uses the range of the
+        spectrum.
+    initial: list or array of floats
+        Start locations of the boxes, in the order of `line_wave`, for
+        example the positions returned by an earlier call; see
+        `adjust_boxes`.
+    kwargs: key value pairs
+        Keywords `layout`, `max_iter`, `adjust_factor`,
+        `factor_decrement`, `backend`, `clusters` and `executor` are
+        used as in `plot_line_ids`.
+
+    Returns
+    -------
+    positions: array of floats
+        Center of each box in data units, in the order of `line_wave`.
+    box_widths: array of floats
+        Width of each box in data units.
+
+    """
+    from .lineid_plot import _is_sorted, _layout_boxes
+
+    line_wave = np.asarray(line_wave, dtype=float)
+    nlines = len(line_wave)
+    assert nlines == len(labels), "Each line must have a label."
+    widths = estimate_text_widths(labels, fontsize, rotation, fontproperties,
+                                  dpi)
+    box_widths = widths * abs(xlim[1] - xlim[0]) / axes_width
+    if edges is None:
+        edges = xlim
+    left_edge, right_edge = sorted(edges)
+
+    if _is_sorted(line_wave):
+        return np.asarray(_layout_boxes(line_wave, box_widths, left_edge,
+                                        right_edge, kwargs,
+                                        initial=initial)), box_widths
+
+    indx = np.argsort(line_wave)
+    if initial is not None:
+        initial = np.asarray(initial, dtype=float)[indx]
+    positions = np.empty(nlines)
+    positions[indx] = _layout_boxes(line_wave[indx], box_widths[indx],
+                                    left_edge, right_edge, kwargs,
+                                    initial=initial)
+    return positions, box_widths
@@ -0,0 +1,169 @@
+"""Lines from labels to the spectrum, drawn as a single collection.
+
+Drawing thousands of lines as separate Line2D artists makes drawing,
+picking and searching for artists slow. `LabelLineCollection` draws all
+of them as one artist, while `CollectionLine` still allows each line to
+be styled on its own, using the label of the line.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+
+__all__ = ['LabelLineCollection', 'CollectionLine']
+
+
+class LabelLineCollection(LineCollection):
+    """LineCollection with styles that can be changed per segment.
+
+    Parameters
+    ----------
+    segments: list of (2, 2) arrays
+        Start and end point of each line.
+    kwargs: key value pairs
+        Passed to LineCollection. Line2D style keywords, such as
+        `color`, `linestyle` and `linewidth` are accepted.
+
+    Attributes
+    ----------
+    lines: list of CollectionLine
+        One for each segment.
+
+    Notes
+    -----
+    Per-segment changes are stored and applied to the collection when it
+    is next drawn. So changing the style of many segments costs the same
+    as changing one.
+
+    """
+
+    def __init__(self, segments, **kwargs):
+        linestyle = kwargs.get('linestyle', kwargs.get('ls', 'solid'))
+        super(LabelLineCollection, self).__init__(segments, **kwargs)
+        n = len(segments)
+        self._seg_data = [np.asarray(s, dtype=float) for s in segments]
+        self._seg_visible = [True] * n
+        self._seg_colors = np.broadcast_to(self.get_colors(), (n, 4)).copy()
+        self._seg_linewidths = np.broadcast_to(
+            self.get_linewidths(), (n,)).copy()
+        self._seg_linestyles = [linestyle] * n
+        self._seg_changed = False
+        self.lines = [CollectionLine(self, i) for i in range(n)]
+        # Style of segments added later.
+        colors = self.get_colors()
+        self._default_style = (
+            tuple(colors[0]) if len(colors) else to_rgba('k'),
+            np.atleast_1d(self.get_linewidths())[0], linestyle)
+
+    def set_lines(self, segments, sources):
+        """Replace the segments, keeping the styles of existing ones.
+
+        Parameters
+        ----------
+        segments: list of (2, 2) arrays
+            Start and end point of each line.
+        sources: list of ints or None
+            For each segment, the index of the current segment whose
+            style and visibility it takes, or None to use the style
+            the collection was created with.
+
+        New CollectionLine instances are created for all segments, and
+        those in `lines` before the call must no longer be used.
+        """
+        color, linewidth, linestyle = self._default_style
+        self._seg_data = [np.asarray(s, dtype=float) for s in segments]
+        self._seg_visible = [True if j is None else self._seg_visible[j]
+                             for j in sources]
+        self._seg_colors = np.array(
+            [color if j is None else self._seg_colors[j] for j in sources],
+            dtype=float).reshape(-1, 4)
+        self._seg_linewidths = np.array(
+            [linewidth if j is None else self._seg_linewidths[j]
+             for j in sources], dtype=float)
+        self._seg_linestyles = [linestyle if j is None else
+                                self._seg_linestyles[j] for j in sources]
+        self.lines = [CollectionLine(self, i) for i in range(len(segments))]
+        self._seg_changed = True
+        self.stale = True
+
+    def _seg_update(self):
+        """Apply the per-segment styles to the collection."""
+        empty = np.empty((0, 2))
+        self.set_segments([s if v else empty for s, v in
+                           zip(self._seg_data, self._seg_visible)])
+        self.set_color(self._seg_colors)
+        self.set_linewidth(self._seg_linewidths)
+        self.set_linestyle(self._seg_linestyles)
+        self._seg_changed = False
+
+    def draw(self, renderer):
+        if self._seg_changed:
+            self._seg_update()
+        super(LabelLineCollection, self).draw(renderer)
+
+
+class CollectionLine(object):
+    """One line in a LabelLineCollection, with an interface like Line2D.
+
+    The methods of Line2D used for styling lines by label are provided,
+    so that these can be used in place of Line2D instances, for example
+    by the functions in `lineid_plot.utils`.
+    """
+
+    def __init__(self, collection, index):
+        self.collection = collection
+        self.index = index
+
+    @property
+    def axes(self):
+        """Axes of the collection, or None if it was removed."""
+        return self.collection.axes
+
+    def _changed(self):
+        self.collection._seg_changed = True
+        self.collection.stale = True
+
+    def get_label(self):
+        return None
+
+    def get_data(self):
+        xy = self.collection._seg_data[self.index]
+        return xy[:, 0], xy[:, 1]
+
+    def set_data(self, x, y):
+        self.collection._seg_data[self.index] = np.column_stack([x, y])
+        self._changed()
+
+    def get_visible(self):
+        return self.collection._seg_visible[self.index]
+
+    def set_visible(self, visible):
+        self.collection._seg_visible[self.index] = bool(visible)
+        self._changed()
+
+    def get_color(self):
+        return tuple(self.collection._seg_colors[self.index])
+
+    def set_color(self, color):
+        self.collection._seg_colors[self.index] = to_rgba(color)
+        self._changed()
+
+    def get_linewidth(self):
+        return self.collection._seg_linewidths[self.index]
+
+    def set_linewidth(self, linewidth):
+        self.collection._seg_linewidths[self.index] = linewidth
+        self._changed()
+
+    def get_linestyle(self):
+        return self.collection._seg_linestyles[self.index]
+
+    def set_linestyle(self, linestyle):
+        self.collection._seg_linestyles[self.index] = linestyle
+        self._changed()
+
+    def set(self, **kwargs):
+        """Set several properties, for example color and linestyle."""
+        for name, value in kwargs.items():
+            getattr(self, "set_" + name)(value)
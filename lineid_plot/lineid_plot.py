@@ -1,16 +1,27 @@
 """Automatic placement of labels for features in a plot.
 
-Depends on Numpy and Matplotlib.
+Depends on Numpy and Matplotlib. Matplotlib is imported by the functions
+that need it, so that importing this module, and using functions such as
+`adjust_boxes` and `unique_labels`, does not select a backend.
 """
 from __future__ import division, print_function
 
+import numbers
+import time
 import warnings
+from collections import Counter, OrderedDict, defaultdict
+from copy import copy
+
 import numpy as np
-from matplotlib import pyplot as plt
 
-__all__ = ['plot_line_ids', 'initial_annotate_kwargs', 'initial_plot_kwargs',
-           'unique_labels', 'get_line_flux', 'get_box_loc', 'adjust_boxes',
-           'prepare_axes']
+__all__ = ['plot_line_ids', 'plot_line_ids_batch', 'initial_annotate_kwargs',
+           'initial_plot_kwargs', 'unique_labels', 'get_line_flux',
+           'LineFluxLookup', 'get_box_loc', 'adjust_boxes', 'place_boxes',
+           'find_clusters', 'layout_clusters',
+           'decimate_minmax', 'cull_lines', 'thin_lines', 'prepare_axes',
+           'TextExtentCache',
+           'text_extent_cache', 'LabelRegistry', 'get_label_registry',
+           'LabelSet', 'LayoutStats']
 
 
 def _convert_to_array(x, size, name):
@@ -37,27 +48,268 @@ def _convert_to_array(x, size, name):
     return xa
 
 
+def _get_renderer(fig):
+    """Renderer that can measure text in `fig` without drawing it.
+
+    Returns None if the canvas can't provide a renderer, or if a layout
+    engine is used, since Axes are moved when the figure is drawn.
+    """
+    get_layout_engine = getattr(fig, "get_layout_engine", None)
+    if get_layout_engine is not None:
+        if get_layout_engine() is not None:
+            return None
+    elif fig.get_tight_layout() or \
+            getattr(fig, "get_constrained_layout", lambda: False)():
+        return None
+
+    try:
+        return fig.canvas.get_renderer()
+    except AttributeError:
+        return None
+
+
+def _font_key(prop):
+    """Hashable summary of a FontProperties instance."""
+    get_math_fontfamily = getattr(prop, "get_math_fontfamily", None)
+    return (tuple(prop.get_family()), prop.get_style(), prop.get_variant(),
+            prop.get_weight(), prop.get_stretch(), prop.get_size_in_points(),
+            prop.get_file(),
+            get_math_fontfamily() if get_math_fontfamily else None)
+
+
+class TextExtentCache(object):
+    """Bounded LRU cache of the widths of text labels, in display units.
+
+    Widths are keyed on the label text, its font properties, rotation,
+    line spacing, whether TeX is used and the DPI of the renderer. So
+    the width of a label is measured only once for a given font, and
+    is then reused by all subsequent plots.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of widths to store. When full, the least
+        recently used width is discarded.
+
+    Attributes
+    ----------
+    hits: int
+        Number of widths found in the cache.
+    misses: int
+        Number of widths that had to be measured.
+
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._widths = OrderedDict()
+
+    def __len__(self):
+        return len(self._widths)
+
+    def get_width(self, text, renderer=None):
+        """Width of the bounding box of the `Text` artist `text`.
+
+        The `renderer` is used for measuring the text, if it is not in
+        the cache. If it is None, then the figure must have been drawn
+        before this is called.
+        """
+        dpi = renderer.dpi if renderer is not None else text.figure.dpi
+        key = (text.get_text(), _font_key(text.get_fontproperties()),
+               text.get_rotation(), text.get_linespacing(),
+               text.get_usetex(), dpi)
+        try:
+            width = self._widths.pop(key)
+        except KeyError:
+            # Only the text is measured, and not the arrow of an
+            # Annotation.
+            from matplotlib.text import Text
+            width = Text.get_window_extent(text, renderer).width
+            self.misses += 1
+            if len(self._widths) >= self.maxsize:
+                self._widths.popitem(last=False)
+        else:
+            self.hits += 1
+        self._widths[key] = width
+        return width
+
+    def clear(self):
+        """Remove all widths and reset the counters."""
+        self._widths.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Cache used by plot_line_ids, unless another is given.
+text_extent_cache = TextExtentCache()
+
+
+def _is_sorted(x, chunk=1 << 20):
+    """True if the 1D array `x` is in non-decreasing order.
+
+    The array is checked in chunks, so that large, possibly memory
+    mapped, arrays don't need large temporary arrays.
+    """
+    for start in range(0, max(len(x) - 1, 0), chunk):
+        stop = min(start + chunk, len(x) - 1)
+        if not np.all(x[start + 1:stop + 1] >= x[start:stop]):
+            return False
+    return True
+
+
+def _sort_spectrum(wave, flux):
+    """Return `wave` and `flux` sorted by wave length.
+
+    If `wave` is already sorted, then the inputs are returned as
+    arrays without copying them. Read-only and memory mapped arrays
+    are accepted.
+    """
+    wave = np.asarray(wave)
+    flux = np.asarray(flux)
+    if not _is_sorted(wave):
+        indx = np.argsort(wave)
+        wave = wave[indx]
+        flux = flux[indx]
+    return wave, flux
+
+
 def get_line_flux(line_wave, wave, flux, **kwargs):
     """Interpolated flux at a given wavelength (calls np.interp)."""
     return np.interp(line_wave, wave, flux, **kwargs)
 
 
+class LineFluxLookup(object):
+    """Interpolated flux of a spectrum, for repeated lookups.
+
+    The spectrum is checked, and sorted if needed, only once, when the
+    instance is created. Each lookup then uses a binary search to find
+    the two samples around each line and interpolates linearly between
+    them, giving the same result as `np.interp`. Only the samples
+    around the lines are read, so memory mapped spectra are not loaded
+    into memory, unless the wave lengths are not float64, in which case
+    they are converted for each lookup.
+
+    Parameters
+    ----------
+    wave: array of floats, or sequence of arrays of floats
+        Wave lengths of data. This can be given as a sequence of chunks,
+        for example one memory mapped array per file. If the chunks are
+        each sorted and do not overlap, then they are used as they are,
+        else they are joined and sorted.
+    flux: array of floats, or sequence of arrays of floats
+        Flux at each wavelength, chunked in the same way as `wave`.
+
+    Examples
+    --------
+    >>> lookup = LineFluxLookup(wave, flux)
+    >>> plot_line_ids(wave, flux, line_wave, line_label1,
+    ...               flux_lookup=lookup)
+
+    """
+
+    def __init__(self, wave, flux):
+        if isinstance(wave, np.ndarray) or not len(wave) or \
+                np.isscalar(wave[0]):
+            wave, flux = [wave], [flux]
+        wave = [np.asarray(w) for w in wave]
+        flux = [np.asarray(f) for f in flux]
+        if len(wave) != len(flux) or \
+                any(len(w) != len(f) for w, f in zip(wave, flux)):
+            raise ValueError("wave and flux must have the same length")
+
+        wave = [w for w in wave if len(w)]
+        flux = [f for f in flux if len(f)]
+        in_order = all(_is_sorted(w) for w in wave) and all(
+            w0[-1] <= w1[0] for w0, w1 in zip(wave[:-1], wave[1:]))
+        if not in_order:
+            wave, flux = _sort_spectrum(np.concatenate(wave),
+                                        np.concatenate(flux))
+            wave, flux = [wave], [flux]
+
+        self._wave = wave
+        self._flux = flux
+        self._starts = np.array([w[0] for w in wave])
+        self._offsets = np.cumsum([0] + [len(w) for w in wave])
+        self.size = int(self._offsets[-1])
+        if not self.size:
+            raise ValueError("wave must not be empty")
+
+    @property
+    def edges(self):
+        """Smallest and largest wave length in the spectrum."""
+        return self._wave[0][0], self._wave[-1][-1]
+
+    def get_sorted(self):
+        """Sorted wave and flux arrays; chunks are joined."""
+        if len(self._wave) == 1:
+            return self._wave[0], self._flux[0]
+        return np.concatenate(self._wave), np.concatenate(self._flux)
+
+    def _take(self, chunks, indx):
+        """Values at the given positions in the joined chunks."""
+        out = np.empty(len(indx))
+        chunk = np.searchsorted(self._offsets, indx, side="right") - 1
+        for k in np.unique(chunk):
+            sel = chunk == k
+            out[sel] = chunks[k][indx[sel] - self._offsets[k]]
+        return out
+
+    def _search(self, x):
+        """Positions j such that wave[j] <= x < wave[j + 1]."""
+        j = np.empty(len(x), dtype=np.intp)
+        chunk = np.searchsorted(self._starts, x, side="right") - 1
+        chunk[chunk < 0] = 0
+        for k in np.unique(chunk):
+            sel = chunk == k
+            # The wave lengths are not cast to the dtype of the chunk,
+            # which would truncate them for integer chunks, and round
+            # them for float32 chunks. Such chunks are converted.
+            j[sel] = self._offsets[k] + np.searchsorted(
+                self._wave[k], x[sel], side="right") - 1
+        return j
+
+    def __call__(self, line_wave):
+        """Flux at the wave lengths `line_wave`."""
+        x = np.asarray(line_wave, dtype=float)
+        shape = x.shape
+        x = x.ravel()
+        if self.size == 1:
+            return np.full(shape, float(self._flux[0][0]))
+
+        j = np.clip(self._search(x), 0, self.size - 2)
+        x0 = self._take(self._wave, j)
+        x1 = self._take(self._wave, j + 1)
+        y0 = self._take(self._flux, j)
+        y1 = self._take(self._flux, j + 1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (y1 - y0) / (x1 - x0)
+            y = slope * (x - x0) + y0
+        y = np.where(x == x0, y0, y)
+        y = np.where(x <= self.edges[0], self._flux[0][0], y)
+        y = np.where(x >= self.edges[1], self._flux[-1][-1], y)
+        return y.reshape(shape)
+
+
 def unique_labels(line_labels):
-    """If a label occurs more than once, add num. as suffix."""
-    from collections import defaultdict
-    d = defaultdict(int)
-    for i in line_labels:
-        d[i] += 1
-    d = dict((i, k) for i, k in d.items() if k != 1)
+    """If a label occurs more than once, add num. as suffix.
+
+    The n-th occurrence of a repeated label "X" becomes "X_num_n". The
+    labels can be given as a list or as a NumPy string array. Runs in
+    time linear in the number of labels.
+    """
+    if isinstance(line_labels, np.ndarray):
+        line_labels = line_labels.tolist()
+    counts = Counter(line_labels)
+    seen = defaultdict(int)
     line_labels_u = []
-    for lab in reversed(line_labels):
-        c = d.get(lab, 0)
-        if c >= 1:
-            v = lab + "_num_" + str(c)
-            d[lab] -= 1
-        else:
-            v = lab
-        line_labels_u.insert(0, v)
+    for lab in line_labels:
+        if counts[lab] > 1:
+            seen[lab] += 1
+            lab = lab + "_num_" + str(seen[lab])
+        line_labels_u.append(lab)
 
     return line_labels_u
 
@@ -79,8 +331,9 @@ def get_box_loc(fig, ax, line_wave, arrow_tip, box_axes_space=0.06):
 
     Returns
     -------
-    box_loc: list of floats
-        Box locations in data coordinates.
+    box_loc: array of floats
+        Box locations in data coordinates, as an array of shape (n, 2)
+        holding the x and y coordinates of each box.
 
     Notes
     -----
@@ -104,26 +357,236 @@ def get_box_loc(fig, ax, line_wave, arrow_tip, box_axes_space=0.06):
     # key word box_axes_spacing above the arrow tip. The default
     # is set to 0.06. This is in figure fraction so that the spacing
     # doesn't depend on the data y range.
-    box_loc = []
-    fig_inv_trans = fig.transFigure.inverted()
-    for w, a in zip(line_wave, arrow_tip):
-        # Convert position of tip of arrow to figure coordinates, add
-        # the vertical space between top edge and text box in figure
-        # fraction. Convert this text box position back to data
-        # coordinates.
-        display_coords = ax.transData.transform((w, a))
-        figure_coords = fig_inv_trans.transform(display_coords)
-        figure_coords[1] += box_axes_space
-        display_coords = fig.transFigure.transform(figure_coords)
-        ax_coords = ax.transData.inverted().transform(display_coords)
-        box_loc.append(ax_coords)
-
-    return box_loc
+    #
+    # Convert position of tip of arrow to display coordinates, add the
+    # vertical space between top edge and text box, converted from
+    # figure fraction to display units. Convert this text box position
+    # back to data coordinates. All points are converted with a single
+    # composite transform.
+    from matplotlib.transforms import Affine2D
+    dy = (fig.transFigure.transform((0, box_axes_space)) -
+          fig.transFigure.transform((0, 0)))[1]
+    trans = (ax.transData + Affine2D().translate(0, dy) +
+             ax.transData.inverted())
+    points = np.column_stack([np.asarray(line_wave, dtype=float),
+                              np.asarray(arrow_tip, dtype=float)])
+    return trans.transform(points)
+
+
+def _display_to_data_widths(ax, line_wave, widths):
+    """Convert widths of boxes centered on lines to data units."""
+    trans = ax.get_xaxis_transform()  # x in data, y in axes coords.
+    x = trans.transform(
+        np.column_stack([line_wave, np.zeros(len(line_wave))]))[:, 0]
+    half = np.asarray(widths, dtype=float) / 2.0
+    inv_trans = trans.inverted()
+    zeros = np.zeros(len(x))
+    left = inv_trans.transform(np.column_stack([x - half, zeros]))[:, 0]
+    right = inv_trans.transform(np.column_stack([x + half, zeros]))[:, 0]
+    return right - left
+
+
+def _nudge_box(wlp, box_widths, i, nlines, left_edge, right_edge,
+               adjust_factor):
+    """Move box `i` away from its neighbours, if they overlap.
+
+    This is one step of the loop in lineid_plot.pro. The location in
+    `wlp` is updated in place. Returns True if the box was moved.
+    """
+    if i > 0:
+        diff1 = wlp[i] - wlp[i - 1]
+        separation1 = (box_widths[i] + box_widths[i - 1]) / 2.0
+    else:
+        diff1 = wlp[i] - left_edge + box_widths[i] * 1.01
+        separation1 = box_widths[i]
+    if i < nlines - 2:
+        diff2 = wlp[i + 1] - wlp[i]
+        separation2 = (box_widths[i] + box_widths[i + 1]) / 2.0
+    else:
+        diff2 = right_edge + box_widths[i] * 1.01 - wlp[i]
+        separation2 = box_widths[i]
+
+    if diff1 < separation1 or diff2 < separation2:
+        if wlp[i] == left_edge:
+            diff1 = 0
+        if wlp[i] == right_edge:
+            diff2 = 0
+        if diff2 > diff1:
+            wlp[i] = wlp[i] + separation2 * adjust_factor
+            wlp[i] = wlp[i] if wlp[i] < right_edge else \
+                right_edge
+        else:
+            wlp[i] = wlp[i] - separation1 * adjust_factor
+            wlp[i] = wlp[i] if wlp[i] > left_edge else \
+                left_edge
+        return True
+    return False
+
+
+def _adjust_boxes_python(line_wave, box_widths, left_edge, right_edge,
+                         max_iter, adjust_factor, factor_decrement, fd_p):
+    """Reference implementation of `adjust_boxes`, one box at a time."""
+    niter = 0
+    changed = True
+    nlines = len(line_wave)
+
+    wlp = copy(line_wave)
+    while changed:
+        changed = False
+        for i in range(nlines):
+            if _nudge_box(wlp, box_widths, i, nlines, left_edge,
+                          right_edge, adjust_factor):
+                changed = True
+            niter += 1
+        if niter == max_iter * fd_p:
+            adjust_factor /= factor_decrement
+        if niter >= max_iter:
+            break
+
+    return wlp, changed, niter
+
+
+def _adjust_boxes_numpy(line_wave, box_widths, left_edge, right_edge,
+                        max_iter, adjust_factor, factor_decrement, fd_p):
+    """Vectorized implementation of `adjust_boxes`.
+
+    In each pass the gaps between all neighbouring boxes, and the
+    separations they require, are calculated using array operations.
+    Boxes that don't overlap their neighbours, and whose left neighbour
+    has not moved during the pass, are left untouched. Only the
+    remaining boxes are visited, in order, using the same update as the
+    reference loop. The results are therefore identical to those from
+    the reference loop.
+    """
+    niter = 0
+    changed = True
+    nlines = len(line_wave)
+
+    wlp = np.array(line_wave, dtype=float)
+    box_widths = np.asarray(box_widths, dtype=float)
+    if nlines == 0:
+        return wlp, False, niter
+
+    # The required separations do not change from one pass to the
+    # next. Note that, as in lineid_plot.pro, the last two boxes are
+    # checked against the right edge and not against their neighbour.
+    separation1 = np.empty(nlines)
+    separation1[0] = box_widths[0]
+    separation1[1:] = (box_widths[1:] + box_widths[:-1]) / 2.0
+    separation2 = box_widths.copy()
+    separation2[:nlines - 2] = (box_widths[:nlines - 2] +
+                                box_widths[1:nlines - 1]) / 2.0
+    right_limit = right_edge + box_widths[max(nlines - 2, 0):] * 1.01
+
+    wl = wlp.tolist()
+    bw = box_widths.tolist()
+    diff1 = np.empty(nlines)
+    diff2 = np.empty(nlines)
+    while changed:
+        changed = False
+        diff1[0] = wlp[0] - left_edge + box_widths[0] * 1.01
+        diff1[1:] = wlp[1:] - wlp[:-1]
+        diff2[:nlines - 2] = wlp[1:nlines - 1] - wlp[:nlines - 2]
+        diff2[max(nlines - 2, 0):] = right_limit - wlp[max(nlines - 2, 0):]
+        overlap = np.flatnonzero((diff1 < separation1) |
+                                 (diff2 < separation2))
+
+        # Moving a box changes the gap to its right neighbour, which
+        # must then be checked again before moving on. Scalar updates
+        # are faster on lists than on arrays, so these are made on
+        # `wl` and then copied back to `wlp`.
+        last = -1
+        moved = []
+        for i in overlap.tolist():
+            if i <= last:
+                continue
+            while i < nlines and _nudge_box(wl, bw, i, nlines, left_edge,
+                                            right_edge, adjust_factor):
+                moved.append(i)
+                i += 1
+            last = i
+        if moved:
+            changed = True
+            wlp[moved] = [wl[i] for i in moved]
+
+        niter += nlines
+        if niter == max_iter * fd_p:
+            adjust_factor /= factor_decrement
+        if niter >= max_iter:
+            break
+
+    return wlp, changed, niter
+
+
+def _adjust_boxes_loop(nudge):
+    """The loop of the reference implementation, calling `nudge`."""
+    def loop(wlp, box_widths, left_edge, right_edge, max_iter,
+             adjust_factor, factor_decrement, fd_p):
+        niter = 0
+        changed = True
+        nlines = len(wlp)
+        while changed:
+            changed = False
+            for i in range(nlines):
+                if nudge(wlp, box_widths, i, nlines, left_edge,
+                         right_edge, adjust_factor):
+                    changed = True
+                niter += 1
+            if niter == max_iter * fd_p:
+                adjust_factor /= factor_decrement
+            if niter >= max_iter:
+                break
+        return changed, niter
+    return loop
+
+
+# Compiled loop; None until the numba backend is first used, and False
+# if Numba is not available.
+_numba_loop = None
+
+
+def _adjust_boxes_numba(line_wave, box_widths, left_edge, right_edge,
+                        max_iter, adjust_factor, factor_decrement, fd_p):
+    """`adjust_boxes` compiled with Numba, if it is installed.
+
+    The reference loop is compiled on first use. Without Numba the
+    reference implementation is used instead, with a warning.
+    """
+    global _numba_loop
+    if _numba_loop is None:
+        try:
+            import numba
+        except ImportError:
+            _numba_loop = False
+        else:
+            _numba_loop = numba.njit(
+                _adjust_boxes_loop(numba.njit(_nudge_box)))
+    if _numba_loop is False:
+        warnings.warn("Numba is not installed; using the 'python' backend "
+                      "of adjust_boxes.")
+        return _adjust_boxes_python(line_wave, box_widths, left_edge,
+                                    right_edge, max_iter, adjust_factor,
+                                    factor_decrement, fd_p)
+
+    wlp = np.array(line_wave, dtype=float)
+    changed, niter = _numba_loop(
+        wlp, np.asarray(box_widths, dtype=float), float(left_edge),
+        float(right_edge), max_iter, float(adjust_factor),
+        float(factor_decrement), float(fd_p))
+    return wlp, changed, niter
+
+
+_ADJUST_BOXES_BACKENDS = {
+    'numba': _adjust_boxes_numba,
+    'numpy': _adjust_boxes_numpy,
+    'python': _adjust_boxes_python,
+}
 
 
 def adjust_boxes(line_wave, box_widths, left_edge, right_edge,
                  max_iter=1000, adjust_factor=0.35,
-                 factor_decrement=3.0, fd_p=0.75):
+                 factor_decrement=3.0, fd_p=0.75, backend='numpy',
+                 initial=None):
     """Ajdust given boxes so that they don't overlap.
 
     Parameters
@@ -150,13 +613,25 @@ def adjust_boxes(line_wave, box_widths, left_edge, right_edge,
         Percentage, given as a fraction between 0 and 1, after which
         adjust_factor must be reduced by a factor of
         `factor_decrement`. Default is set to 0.75.
+    backend: str
+        Implementation to use. The default, 'numpy', uses array
+        operations to find the boxes that must be moved in each
+        pass. 'python' is the reference implementation that visits
+        every box in every pass. 'numba' compiles the reference
+        implementation using Numba, if it is installed, and falls back
+        to 'python' if not. All give identical results.
+    initial: list or array of floats
+        Initial location of the boxes, for example the result of an
+        earlier call for nearly the same lines. If the boxes already
+        don't overlap, then they are returned after one pass. The
+        default is `line_wave`.
 
     Returns
     -------
-    wlp, niter, changed: (float, float, float)
-        The new y (wave length) location of the text boxes, the number
-        of iterations used and a flag to indicated whether any changes to
-        the input locations were made or not.
+    wlp, changed, niter: (float, bool, int)
+        The new y (wave length) location of the text boxes, a flag to
+        indicated whether any changes were made in the last pass and the
+        number of iterations used.
 
     Notes
     -----
@@ -174,62 +649,395 @@ def adjust_boxes(line_wave, box_widths, left_edge, right_edge,
     + http://idlastro.gsfc.nasa.gov/
 
     """
-    # Adjust positions.
-    niter = 0
-    changed = True
+    try:
+        adjust = _ADJUST_BOXES_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            "backend must be one of {0}".format(
+                sorted(_ADJUST_BOXES_BACKENDS)))
+
+    if initial is None:
+        initial = line_wave
+    elif len(initial) != len(line_wave):
+        raise ValueError("initial must have one location for each line")
+
+    return adjust(initial, box_widths, left_edge, right_edge,
+                  max_iter, adjust_factor, factor_decrement, fd_p)
+
+
+def place_boxes(line_wave, box_widths, left_edge, right_edge):
+    """Place boxes so that they don't overlap, with minimum displacement.
+
+    Parameters
+    ----------
+    line_wave: list or array of floats
+        Line wave lengths. These are the preferred locations of the
+        centers of the boxes.
+    box_widths: list or array of floats
+        Width of box containing labels for each line identification.
+    left_edge: float
+        Left edge of valid data i.e., wave length minimum.
+    right_edge: float
+        Right edge of valid data i.e., wave lengths maximum.
+
+    Returns
+    -------
+    wlp: array of floats
+        The new location of the centers of the text boxes, in the same
+        order as `line_wave`.
+
+    Notes
+    -----
+    Unlike `adjust_boxes` this is not iterative. Boxes are kept in the
+    order of `line_wave` and the sum of the squares of the distances
+    between the boxes and their lines is minimized, subject to the
+    boxes not overlapping and lying between `left_edge` and
+    `right_edge`.
+
+    Subtracting the cumulative sum of the separations required between
+    neighbouring boxes from the box locations turns this into an
+    isotonic regression problem, which is solved using the
+    pool-adjacent-violators algorithm. Apart from the initial sort this
+    takes a single O(n) pass.
+
+    If the boxes are too wide to fit between the edges, then they are
+    placed next to each other, centered between the edges.
+
+    """
+    line_wave = np.asarray(line_wave, dtype=float)
+    box_widths = np.asarray(box_widths, dtype=float)
     nlines = len(line_wave)
+    if nlines == 0:
+        return np.array(line_wave)
 
-    wlp = line_wave[:]
-    while changed:
-        changed = False
-        for i in range(nlines):
-            if i > 0:
-                diff1 = wlp[i] - wlp[i - 1]
-                separation1 = (box_widths[i] + box_widths[i - 1]) / 2.0
-            else:
-                diff1 = wlp[i] - left_edge + box_widths[i] * 1.01
-                separation1 = box_widths[i]
-            if i < nlines - 2:
-                diff2 = wlp[i + 1] - wlp[i]
-                separation2 = (box_widths[i] + box_widths[i + 1]) / 2.0
+    indx = np.argsort(line_wave, kind="mergesort")
+    w = box_widths[indx]
+
+    # Location of each box when all boxes are packed next to each
+    # other, starting with the first box at zero.
+    offsets = np.zeros(nlines)
+    offsets[1:] = np.cumsum((w[1:] + w[:-1]) / 2.0)
+
+    # Pool adjacent violators: merge neighbouring blocks until the
+    # block means are non-decreasing.
+    means = []
+    counts = []
+    for t in (line_wave[indx] - offsets).tolist():
+        m, c = t, 1
+        while means and means[-1] > m:
+            pc = counts.pop()
+            m = (means.pop() * pc + m * c) / (pc + c)
+            c += pc
+        means.append(m)
+        counts.append(c)
+    y = np.repeat(means, counts)
+
+    lower = left_edge + w[0] / 2.0
+    upper = right_edge - w[-1] / 2.0 - offsets[-1]
+    if lower <= upper:
+        y = np.clip(y, lower, upper)
+    else:
+        y[:] = (lower + upper) / 2.0
+
+    wlp = np.empty(nlines)
+    wlp[indx] = y + offsets
+    return wlp
+
+
+def find_clusters(line_wave, box_widths):
+    """Split sorted lines into groups whose boxes cannot interact.
+
+    Parameters
+    ----------
+    line_wave: list or array of floats
+        Line wave lengths, sorted.
+    box_widths: list or array of floats
+        Width of the box of each line.
+
+    Returns
+    -------
+    clusters: list of (int, int)
+        Start and stop index of each group, in order.
+
+    Notes
+    -----
+    Neighbouring boxes that overlap start in the same group. Boxes in
+    a group of total width W, with lines from `lo` to `hi`, are placed
+    by `place_boxes` within ``lo - 1.5 W`` and ``hi + 1.5 W``.
+    Neighbouring groups whose ranges overlap are merged, until no two
+    do, so that the groups can be placed independently.
+
+    """
+    line_wave = np.asarray(line_wave, dtype=float)
+    box_widths = np.asarray(box_widths, dtype=float)
+    nlines = len(line_wave)
+    if nlines == 0:
+        return []
+
+    # Groups of overlapping neighbours.
+    gap = np.diff(line_wave) - (box_widths[1:] + box_widths[:-1]) / 2.0
+    starts = np.concatenate([[0], np.flatnonzero(gap >= 0) + 1])
+    stops = np.concatenate([starts[1:], [nlines]])
+    totals = np.add.reduceat(box_widths, starts)
+
+    # Merge with the previous group while their ranges overlap.
+    merged = []  # [start, stop, total width]
+    for start, stop, total in zip(starts.tolist(), stops.tolist(),
+                                  totals.tolist()):
+        while merged:
+            p_start, p_stop, p_total = merged[-1]
+            if line_wave[p_stop - 1] + 1.5 * p_total < \
+                    line_wave[start] - 1.5 * total:
+                break
+            merged.pop()
+            start, total = p_start, p_total + total
+        merged.append([start, stop, total])
+    return [(start, stop) for start, stop, _ in merged]
+
+
+def _solve_cluster(job):
+    """Layout of one cluster; used by `layout_clusters`."""
+    line_wave, box_widths, left_edge, right_edge, layout, initial, \
+        kwargs = job
+    if layout == 'exact':
+        return place_boxes(line_wave, box_widths, left_edge,
+                           right_edge), False, 0
+    return adjust_boxes(line_wave, box_widths, left_edge, right_edge,
+                        initial=initial, **kwargs)
+
+
+def layout_clusters(line_wave, box_widths, left_edge, right_edge,
+                    layout='iterative', executor=None, initial=None,
+                    **kwargs):
+    """Place boxes by laying out independent clusters separately.
+
+    Parameters
+    ----------
+    line_wave, box_widths, left_edge, right_edge:
+        As for `adjust_boxes`. `line_wave` must be sorted.
+    layout: str
+        'iterative' to use `adjust_boxes` and 'exact' to use
+        `place_boxes` for each cluster.
+    executor: concurrent.futures.Executor or None
+        If given, the clusters are laid out in parallel using its
+        `map` method.
+    initial: list or array of floats
+        Start locations of the boxes for `adjust_boxes`.
+    kwargs: key value pairs
+        Passed to `adjust_boxes`.
+
+    Returns
+    -------
+    wlp, changed, niter: (array of floats, bool, int)
+        As for `adjust_boxes`. `changed` is True if any cluster was
+        still changing, and `niter` is the total over all clusters.
+
+    Notes
+    -----
+    The lines are split by `find_clusters`. Clusters of boxes that
+    don't overlap each other and lie within the edges are not laid out
+    at all. For the 'exact' layout the result is that of `place_boxes`
+    for all the lines, if they fit between the edges. `adjust_boxes`
+    is run for each cluster with the given `max_iter`, and so the
+    result differs from that of a single run for all the lines. If the
+    boxes of neighbouring clusters overlap after the layout, then the
+    clusters are merged and laid out again.
+
+    """
+    line_wave = np.asarray(line_wave, dtype=float)
+    box_widths = np.asarray(box_widths, dtype=float)
+    nlines = len(line_wave)
+    if layout not in ('iterative', 'exact'):
+        raise ValueError("layout must be 'iterative' or 'exact'")
+    if initial is None:
+        initial = line_wave
+    wlp = np.array(initial, dtype=float)
+    if box_widths.sum() > right_edge - left_edge:
+        clusters = [(0, nlines)] if nlines else []
+    else:
+        clusters = find_clusters(line_wave, box_widths)
+
+    changed = False
+    niter = 0
+    todo = clusters
+    while todo:
+        jobs = []
+        solved = []
+        for start, stop in todo:
+            w = box_widths[start:stop]
+            x = wlp[start:stop]
+            if (np.all(np.diff(x) >= (w[1:] + w[:-1]) / 2.0) and
+                    x[0] - w[0] / 2.0 >= left_edge and
+                    x[-1] + w[-1] / 2.0 <= right_edge):
+                continue
+            jobs.append((line_wave[start:stop], w, left_edge, right_edge,
+                         layout, x, kwargs))
+            solved.append((start, stop))
+        results = executor.map(_solve_cluster, jobs) if executor else \
+            map(_solve_cluster, jobs)
+        for (start, stop), (x, c, n) in zip(solved, results):
+            wlp[start:stop] = x
+            changed = changed or c
+            niter += n
+
+        # Merge neighbouring clusters whose boxes overlap, and lay out
+        # the merged clusters again.
+        merged = [list(clusters[0])] if clusters else []
+        todo = []
+        for start, stop in clusters[1:]:
+            p = merged[-1]
+            if wlp[p[1] - 1] + box_widths[p[1] - 1] / 2.0 > \
+                    wlp[start] - box_widths[start] / 2.0:
+                p[1] = stop
+                if not todo or todo[-1] is not p:
+                    todo.append(p)
             else:
-                diff2 = right_edge + box_widths[i] * 1.01 - wlp[i]
-                separation2 = box_widths[i]
-
-            if diff1 < separation1 or diff2 < separation2:
-                if wlp[i] == left_edge:
-                    diff1 = 0
-                if wlp[i] == right_edge:
-                    diff2 = 0
-                if diff2 > diff1:
-                    wlp[i] = wlp[i] + separation2 * adjust_factor
-                    wlp[i] = wlp[i] if wlp[i] < right_edge else \
-                        right_edge
-                else:
-                    wlp[i] = wlp[i] - separation1 * adjust_factor
-                    wlp[i] = wlp[i] if wlp[i] > left_edge else \
-                        left_edge
-                changed = True
-            niter += 1
-        if niter == max_iter * fd_p:
-            adjust_factor /= factor_decrement
-        if niter >= max_iter:
-            break
+                merged.append([start, stop])
+        clusters = [tuple(c) for c in merged]
+        todo = [tuple(c) for c in todo]
 
     return wlp, changed, niter
 
 
+def decimate_minmax(wave, flux, nbins):
+    """Reduce a spectrum to the minimum and maximum flux in each bin.
+
+    Parameters
+    ----------
+    wave: array of floats
+        Wave lengths of data, sorted.
+    flux: array of floats
+        Flux at each wavelength.
+    nbins: int
+        Number of bins. The bins have equal widths in wave length, from
+        the first to the last wave length, so that they follow the
+        pixel columns of a linear x axis even if the samples are not
+        evenly spaced.
+
+    Returns
+    -------
+    wave, flux: arrays of floats
+        The samples with the minimum and the maximum flux in each bin,
+        along with the first and last samples, in their original order.
+        If there are not more than two samples per bin on average, then
+        the inputs are returned unchanged.
+
+    Notes
+    -----
+    When `nbins` is the width of the Axes in pixels, the plotted line
+    covers the same pixels as a plot of the full spectrum, so narrow
+    absorption and emission features remain visible. This holds for
+    the resolution at which `nbins` was found: a figure saved at a
+    higher dpi has wider Axes, in pixels, than on screen.
+
+    """
+    wave = np.asarray(wave)
+    flux = np.asarray(flux)
+    n = len(flux)
+    nbins = max(int(nbins), 1)
+    if n <= 2 * nbins + 2:
+        return wave, flux
+
+    # First sample of each bin; empty bins are dropped.
+    edges = np.linspace(wave[0], wave[-1], nbins + 1)[:-1]
+    starts = np.unique(np.searchsorted(wave, edges, side='left'))
+    counts = np.diff(np.append(starts, n))
+    indx = [[0, n - 1]]
+    for reduce_ in (np.minimum, np.maximum):
+        extreme = np.repeat(reduce_.reduceat(flux, starts), counts)
+        # First sample in each bin with the extreme flux.
+        hits = np.flatnonzero(flux == extreme)
+        first = np.unique(np.searchsorted(starts, hits, side='right'),
+                          return_index=True)[1]
+        indx.append(hits[first])
+    indx = np.unique(np.concatenate(indx))
+    return wave[indx], flux[indx]
+
+
+def cull_lines(line_wave, xmin, xmax):
+    """Range of the lines with wave lengths from `xmin` to `xmax`.
+
+    Parameters
+    ----------
+    line_wave: array of floats
+        Wave lengths of the lines, sorted.
+    xmin, xmax: float
+        Limits of the range, inclusive.
+
+    Returns
+    -------
+    i0, i1: int
+        ``line_wave[i0:i1]`` are the lines within the range.
+
+    """
+    i0 = np.searchsorted(line_wave, xmin, side='left')
+    i1 = np.searchsorted(line_wave, xmax, side='right')
+    return int(i0), int(max(i0, i1))
+
+
+def thin_lines(x, span, priority=None):
+    """Indices of the lines to keep so that they are at least sparse.
+
+    The positions `x` are split into bins of width `span`, and only one
+    line is kept in each bin: the one with the highest `priority`, or
+    the first one if no priorities are given.
+
+    Parameters
+    ----------
+    x: array of floats
+        Positions of the lines, for example in display units.
+    span: float
+        Width of the bins.
+    priority: array of floats
+        Importance of each line, such as its strength.
+
+    Returns
+    -------
+    indx: array of ints
+        Indices of the lines kept, in increasing order.
+
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return np.arange(0)
+    bins = np.floor((x - x.min()) / span)
+    if priority is None:
+        priority = np.zeros(len(x))
+    # Sort on bin, then on decreasing priority; the sort is stable so
+    # that ties keep the first line.
+    order = np.lexsort((-np.asarray(priority, dtype=float), bins))
+    first = np.unique(bins[order], return_index=True)[1]
+    return np.sort(order[first])
+
+
 def prepare_axes(wave, flux, fig=None, ax_lower=(0.1, 0.1),
-                 ax_dim=(0.85, 0.65)):
-    """Create fig and axes if needed and layout axes in fig."""
+                 ax_dim=(0.85, 0.65), decimate=False):
+    """Create fig and axes if needed and layout axes in fig.
+
+    If `decimate` is True, then only the minimum and maximum flux in
+    each pixel column of the Axes are plotted; see `decimate_minmax`.
+    The columns are those at the dpi of the figure when it is plotted.
+    An integer gives the number of columns to use instead, for example
+    for a figure that will be saved at a higher dpi.
+    """
     # Axes location in figure.
     if not fig:
+        from matplotlib import pyplot as plt
         fig = plt.figure()
     ax = fig.add_axes([ax_lower[0], ax_lower[1], ax_dim[0], ax_dim[1]])
-    ax.plot(wave, flux)
+    ax.plot(*_decimate_for_axes(ax, wave, flux, decimate))
     return fig, ax
 
 
+def _decimate_for_axes(ax, wave, flux, decimate):
+    """Spectrum to plot in `ax`, decimated as in `prepare_axes`."""
+    if decimate:
+        if decimate is True:
+            decimate = int(np.ceil(ax.bbox.width))
+        wave, flux = decimate_minmax(wave, flux, decimate)
+    return wave, flux
+
+
 def initial_annotate_kwargs():
     """Return default parameters passed to Axes.annotate to create labels."""
     return dict(
@@ -244,6 +1052,148 @@ def initial_plot_kwargs():
     return dict(linestyle="--", color="k",)
 
 
+class LayoutStats(object):
+    """Timings and layout results of a call to `plot_line_ids`.
+
+    Attributes
+    ----------
+    times: OrderedDict
+        Wall clock time, in seconds, of each phase, in the order in
+        which they ran. The phases are 'prepare_lines' (sorting and
+        unique labels), 'axes' (creating the Axes and plotting the
+        spectrum), 'select' (culling), 'line_flux', 'artists',
+        'measure' (text widths), 'layout', 'place' and 'draw'.
+    nlines: int
+        Number of lines labelled.
+    niter: int or None
+        Number of iterations used by `adjust_boxes`. None for other
+        layouts, and if the layout was reused.
+    converged: bool or None
+        False if `adjust_boxes` stopped after `max_iter` iterations
+        with boxes still being moved. None for other layouts, and if
+        the layout was reused.
+    overlaps: int
+        Number of pairs of neighbouring boxes that overlap after the
+        layout.
+
+    """
+
+    def __init__(self):
+        self.times = OrderedDict()
+        self.nlines = 0
+        self.niter = None
+        self.converged = None
+        self.overlaps = 0
+        self._last = time.time()
+
+    @property
+    def total(self):
+        """Total time of all phases, in seconds."""
+        return sum(self.times.values())
+
+    def lap(self, phase):
+        """Add the time since the previous lap to `phase`."""
+        now = time.time()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def __repr__(self):
+        return ("LayoutStats(nlines={0}, niter={1}, converged={2}, "
+                "overlaps={3}, total={4:.4f})".format(
+                    self.nlines, self.niter, self.converged, self.overlaps,
+                    self.total))
+
+
+def _count_overlaps(wlp, box_widths):
+    """Number of neighbouring boxes that overlap; boxes are sorted."""
+    wlp = np.asarray(wlp, dtype=float)
+    box_widths = np.asarray(box_widths, dtype=float)
+    if len(wlp) < 2:
+        return 0
+    gap = np.diff(wlp) - (box_widths[1:] + box_widths[:-1]) / 2.0
+    tol = 1e-9 * max(np.ptp(wlp), box_widths.max(), 1.0)
+    return int(np.count_nonzero(gap < -tol))
+
+
+def _report_stats(stats, kwargs):
+    """Pass `stats` to the `stats` keyword of `plot_line_ids`."""
+    target = kwargs.get('stats', None)
+    if target is None:
+        return
+    if isinstance(target, LayoutStats):
+        target.__dict__.update(stats.__dict__)
+    else:
+        target(stats)
+
+
+class LabelRegistry(object):
+    """Artists created by `plot_line_ids` in an Axes, keyed on label.
+
+    The keys are the unique labels created by `unique_labels`, in the
+    order of the wave lengths of the lines. These are used even if
+    labels are not added to the artists. If `plot_line_ids` is called
+    more than once on an Axes, then a label has the artists of each
+    call, in the order of the calls.
+
+    Artists removed from the Axes, for example by ``ax.cla()`` or by
+    their `remove` method, are dropped when the Axes is next labelled.
+    Until then they are still listed; their `axes` attribute is None.
+
+    Attributes
+    ----------
+    boxes: dict
+        Maps each label to a list of its Annotations.
+    lines: dict
+        Maps each label to a list of the Line2D drawn from the
+        annotation to the flux level, for lines that have one.
+    label_sets: list of LabelSet
+        One for each call to `plot_line_ids` with `interactive`,
+        `animated` or `return_handle`. LabelSets whose artists were
+        all removed are dropped when the Axes is next labelled.
+
+    """
+
+    def __init__(self):
+        self.boxes = {}
+        self.lines = {}
+        self.label_sets = []
+
+    def add(self, label, box=None, line=None):
+        """Record the box and, or, the line of `label`."""
+        for artists, artist in ((self.boxes, box), (self.lines, line)):
+            if artist is not None:
+                artists.setdefault(label, []).append(artist)
+
+    def discard(self, label, box=None, line=None):
+        """Forget the box and, or, the line of `label`."""
+        for artists, artist in ((self.boxes, box), (self.lines, line)):
+            if artist is None or label not in artists:
+                continue
+            kept = [a for a in artists[label] if a is not artist]
+            if kept:
+                artists[label] = kept
+            else:
+                del artists[label]
+
+    def prune(self):
+        """Forget artists, and LabelSets, no longer in an Axes."""
+        for artists in (self.boxes, self.lines):
+            for label in list(artists):
+                kept = [a for a in artists[label] if a.axes is not None]
+                if kept:
+                    artists[label] = kept
+                else:
+                    del artists[label]
+        self.label_sets = [s for s in self.label_sets if s._in_axes()]
+
+
+def get_label_registry(ax):
+    """LabelRegistry of `ax`, or None if it has no labels."""
+    # The registry is kept on the Axes, and not in a module level
+    # mapping, so that it doesn't keep closed figures alive.
+    return getattr(ax, '_lineid_registry', None)
+
+
 def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
                   extend=True, annotate_kwargs=None, plot_kwargs=None,
                   **kwargs):
@@ -288,6 +1238,18 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
               associated with `ax` is used. If `fig` and `ax` are not
               given then a new figure is created and an axes is added
               to it.
+          flux_lookup: LineFluxLookup
+              Used for the flux at the lines and the range of wave
+              lengths, instead of `wave` and `flux`. Reusing a lookup
+              avoids checking and sorting the same spectrum again when
+              it is labelled with different line lists. `wave` and
+              `flux` are not used if `ax` is also given.
+          decimate: boolean or int
+              If True, and a new Axes is created, then only the
+              minimum and maximum flux in each pixel column of the
+              Axes are plotted. This keeps very large spectra fast to
+              draw and save. An integer gives the number of columns;
+              see `prepare_axes`. Default is False.
           arrow_tip: scalar or list of floats
               The location of the annotation point, in data coords. If
               the value is scalar then it is used for all. Default
@@ -304,10 +1266,82 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
               layout appearance is independent of the y data range.
           max_iter: int
               Maximum iterations to use. Default is set to 1000.
+          layout: str
+              Algorithm used to find the x locations of the label
+              boxes. The default, 'iterative', uses `adjust_boxes`.
+              'exact' uses `place_boxes`, which never leaves boxes
+              overlapping if they fit between the edges of the data.
+          backend: str
+              Implementation of `adjust_boxes` used by the 'iterative'
+              layout: 'numpy' (default), 'python' or 'numba'.
+          clusters: boolean
+              If True then groups of lines whose labels cannot
+              interact are laid out separately; see
+              `layout_clusters`. Default is False.
+          executor: concurrent.futures.Executor
+              Used to lay out the groups in parallel, if `clusters`
+              is True. Only used by this call; later layouts by the
+              LabelSet of the labels are not parallel.
           add_label_to_artists: boolean
               If True (default is True) then add unique labels to artists, both
               text labels and line extending from text label to spectrum. If
               False then don't add such labels.
+          cull: boolean or float
+              If True then only lines within the x limits of the Axes,
+              widened by 5% of their range on each side, are labelled.
+              A float gives the widening instead. The limits are those
+              of the Axes after the spectrum is plotted. None is the
+              same as False, which is the default.
+          lod_pixels: float
+              If given then at most one label is drawn in each span of
+              this many pixels along the x axis; see `thin_lines`.
+          priority: list of floats
+              Importance of each line, for example its strength. Used
+              to choose the label that is drawn, when `lod_pixels` is
+              given.
+          previous_layout: LabelSet
+              Labels placed earlier, for example for the previous
+              frame of an animation; see `LabelRegistry`. With the
+              'iterative' layout, each box starts at the same offset
+              from its line as the box with the same unique label in
+              `previous_layout`, instead of at the line. The layout
+              then converges in a few passes, and labels don't jump
+              between frames. The widths of the labels are reused
+              from the text extent cache.
+          animated: boolean
+              If True then the spectrum and the lines from the boxes
+              to the flux are animated, for blitting; see
+              `LabelSet.set_animated`. Default is False.
+          return_handle: boolean
+              If True then the LabelSet of the labels is returned as
+              well. Its `update` method moves the labels to new lines
+              reusing the artists. Default is False.
+          stats: LayoutStats or callable
+              If a LayoutStats instance is given, then it is updated
+              with the time taken by each phase of labelling and with
+              the results of the layout. If a callable is given, then
+              it is called with a new LayoutStats instance. Default is
+              None.
+          interactive: boolean
+              If True then the labels are laid out again whenever the
+              Axes is zoomed, panned or resized; see
+              `LabelSet.connect`. Default is False.
+          line_collection: boolean
+              If True then the lines from the annotations to the flux
+              are drawn as a single LabelLineCollection, instead of
+              one Line2D per line. `plot_kwargs` must then be valid for
+              a LineCollection. The lines can still be styled by label
+              using the registry of the Axes; see `get_label_registry`.
+              Default is False.
+          extent_cache: TextExtentCache or None
+              Cache for the widths of the labels. The default is the
+              module level cache `text_extent_cache`. If None then
+              the width of every label is measured.
+          draw: boolean
+              If True (default is True) then request a redraw of the
+              canvas once the labels are placed. Set this to False if
+              the figure is going to be saved to a file, since saving
+              renders the figure anyway.
     Returns
     -------
     fig, ax: Matplotlib Figure, Matplotlib Axes
@@ -315,7 +1349,11 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
         instance on which the labels were placed. These can be used for
         further customizations. For example, some labels can be hidden
         by accessing the corresponding `Text` instance form the
-        `ax.texts` list.
+        `ax.texts` list. The artists created can also be obtained,
+        using their unique labels, from the registry returned by
+        ``get_label_registry(ax)``.
+    handle: LabelSet
+        Only returned if `return_handle` is True.
 
     Notes
     -----
@@ -349,10 +1387,89 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
       specified artists.
 
     """
-    wave = np.array(wave)
-    flux = np.array(flux)
-    line_wave = np.array(line_wave)
-    line_label1 = np.array(line_label1)
+    stats = LayoutStats()
+    lines = _prepare_lines(line_wave, line_label1, label1_size, extend,
+                           annotate_kwargs, plot_kwargs,
+                           kwargs.get('add_label_to_artists', True),
+                           kwargs.get('priority', None))
+    stats.lap('prepare_lines')
+    fig, ax = _label_axes(wave, flux, lines, kwargs, stats=stats)
+    _report_stats(stats, kwargs)
+    if kwargs.get('return_handle', False):
+        return fig, ax, get_label_registry(ax).label_sets[-1]
+    return fig, ax
+
+
+def plot_line_ids_batch(spectra, line_wave, line_label1, label1_size=None,
+                        extend=True, annotate_kwargs=None, plot_kwargs=None,
+                        **kwargs):
+    """Label many spectra with the same lines.
+
+    Parameters
+    ----------
+    spectra: sequence of (wave, flux, ax) tuples
+        Wave lengths and fluxes of each spectrum, and the Axes in which
+        its labels are to be placed. If an Axes is None then a new
+        figure and Axes is created for that spectrum, as done by
+        `plot_line_ids`.
+    line_wave, line_label1, label1_size, extend, annotate_kwargs,
+    plot_kwargs, kwargs:
+        Same as for `plot_line_ids`, and used for every spectrum.
+        Keywords `ax` and `fig` are ignored. A `stats` callable is
+        called once for each spectrum; the phase 'prepare_lines' is
+        not included.
+
+    Returns
+    -------
+    figs_and_axes: list of (Matplotlib Figure, Matplotlib Axes)
+        Figure and Axes instances, one pair for each spectrum.
+
+    Notes
+    -----
+    Sorting the lines, creating unique labels and merging the keyword
+    arguments for `annotate` and `plot` are done only once. Label
+    widths are taken from the text extent cache, if one is used, and
+    the label layout is calculated only once for all Axes that have the
+    same label widths and data range, such as Axes of equal size
+    showing the same wave length range.
+
+    """
+    lines = _prepare_lines(line_wave, line_label1, label1_size, extend,
+                           annotate_kwargs, plot_kwargs,
+                           kwargs.get('add_label_to_artists', True),
+                           kwargs.get('priority', None))
+    draw = kwargs.get('draw', True)
+    kwargs = dict(kwargs, draw=False, fig=None)
+    layouts = {}
+    figs_and_axes = []
+    for wave, flux, ax in spectra:
+        kwargs['ax'] = ax
+        stats = LayoutStats()
+        figs_and_axes.append(_label_axes(wave, flux, lines, kwargs, layouts,
+                                         stats))
+        _report_stats(stats, kwargs)
+
+    # Update each figure once, after all its Axes are labelled.
+    if draw:
+        figs = []
+        for fig, ax in figs_and_axes:
+            if fig not in figs:
+                figs.append(fig)
+                fig.canvas.draw_idle()
+
+    return figs_and_axes
+
+
+def _prepare_lines(line_wave, line_label1, label1_size, extend,
+                   annotate_kwargs, plot_kwargs, add_label_to_artists,
+                   priority=None):
+    """Sort the lines and create labels and keywords for the artists.
+
+    The result does not depend on the data or the Axes, and can be used
+    for labelling any number of spectra.
+    """
+    line_wave = np.asarray(line_wave)
+    line_label1 = np.asarray(line_label1)
 
     nlines = len(line_wave)
     assert nlines == len(line_label1), "Each line must have a label."
@@ -362,28 +1479,99 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
     label1_size = _convert_to_array(label1_size, nlines, "lable1_size")
 
     extend = _convert_to_array(extend, nlines, "extend")
+    if priority is not None:
+        priority = _convert_to_array(priority, nlines, "priority")
 
-    # Sort.
-    indx = np.argsort(wave)
-    wave[:] = wave[indx]
-    flux[:] = flux[indx]
-    indx = np.argsort(line_wave)
-    line_wave[:] = line_wave[indx]
-    line_label1[:] = line_label1[indx]
-    label1_size[:] = label1_size[indx]
+    # Sort, if needed. The caller's arrays are not modified.
+    if not _is_sorted(line_wave):
+        indx = np.argsort(line_wave)
+        line_wave = line_wave[indx]
+        line_label1 = line_label1[indx]
+        label1_size = label1_size[indx]
+        extend = extend[indx]
+        if priority is not None:
+            priority = priority[indx]
+
+    # If any labels are repeated add "_num_#" to it. If there are 3 "X"
+    # then the first gets "X_num_3". The result is passed as the label
+    # parameter of annotate. This makes it easy to find the box
+    # corresponding to a label using Figure.findobj. But the downside is that a
+    # call to plt.legend() will display legends for the lines (from text to
+    # spectrum location). So we don't add the label to artists if the user
+    # doesn't want to. The unique labels are always used as keys in the
+    # LabelRegistry of the Axes.
+    al = add_label_to_artists
+    labels = unique_labels(line_label1)
+    label_u = labels if al else [None for _ in line_label1]
+    label_u_line = [i + "_line" for i in label_u] if al else label_u
+
+    if annotate_kwargs is None:
+        annotate_kwargs = {}
+    if plot_kwargs is None:
+        plot_kwargs = {}
+    ak = initial_annotate_kwargs()
+    ak.update(annotate_kwargs)
+    pk = initial_plot_kwargs()
+    pk.update(plot_kwargs)
+
+    return dict(line_wave=line_wave, line_label1=line_label1,
+                label1_size=label1_size, extend=extend, labels=labels,
+                label_u=label_u, label_u_line=label_u_line, annotate_kwargs=ak,
+                plot_kwargs=pk, priority=priority)
 
-    # Flux at the line wavelengths.
-    line_flux = get_line_flux(line_wave, wave, flux)
+
+def _label_axes(wave, flux, lines, kwargs, layouts=None, stats=None,
+                label_set=None):
+    """Plot the labels in `lines` for one spectrum.
+
+    `kwargs` are the keywords accepted by `plot_line_ids`. If
+    `layouts` is a dict, then label locations are stored in it, and
+    reused if the same label widths and data range are seen again.
+    Timings and layout results are recorded in the LayoutStats `stats`.
+    If `label_set` is given, then its Axes and artists are reused, and
+    it is updated to hold the new labels.
+    """
+    if stats is None:
+        stats = LayoutStats()
+    line_wave = lines['line_wave']
+    line_label1 = lines['line_label1']
+    label1_size = lines['label1_size']
+    extend = lines['extend']
+    labels = lines['labels']
+    label_u = lines['label_u']
+    label_u_line = lines['label_u_line']
+    ak = lines['annotate_kwargs']
+    pk = lines['plot_kwargs']
+    nlines = len(line_wave)
+
+    # The spectrum is sorted, if needed, by LineFluxLookup. A lookup
+    # created earlier can be reused.
+    lookup = kwargs.get('flux_lookup', None)
+    if lookup is None:
+        lookup = LineFluxLookup(wave, flux)
 
     # Figure and Axes. If Axes is given then use it. If not, create
     # figure, if not given, and add Axes to it using a default
     # layout. Also plot the data in the Axes.
     ax = kwargs.get("ax", None)
-    if not ax:
+    spectrum = None
+    if label_set is not None:
+        ax = label_set.ax
+        fig = ax.figure
+        spectrum = label_set.spectrum
+        if spectrum is not None:
+            wave, flux = lookup.get_sorted()
+            spectrum.set_data(*_decimate_for_axes(
+                ax, wave, flux, kwargs.get('decimate', False)))
+    elif not ax:
         fig = kwargs.get("fig", None)
-        fig, ax = prepare_axes(wave, flux, fig)
+        wave, flux = lookup.get_sorted()
+        fig, ax = prepare_axes(wave, flux, fig,
+                               decimate=kwargs.get('decimate', False))
+        spectrum = ax.lines[-1]
     else:
         fig = ax.figure
+    stats.lap('axes')
 
     # Find location of the tip of the arrow. Either the top edge of the
     # Axes or the given data coordinates.
@@ -402,82 +1590,630 @@ def plot_line_ids(wave, flux, line_wave, line_label1, label1_size=None,
         box_loc = get_box_loc(fig, ax, line_wave, arrow_tip, box_axes_space)
     else:
         box_loc = _convert_to_array(box_loc, nlines, "box_loc")
-        box_loc = tuple(zip(line_wave, box_loc))
+        box_loc = np.column_stack([line_wave, box_loc])
 
-    # If any labels are repeated add "_num_#" to it. If there are 3 "X"
-    # then the first gets "X_num_3". The result is passed as the label
-    # parameter of annotate. This makes it easy to find the box
-    # corresponding to a label using Figure.findobj. But the downside is that a
-    # call to plt.legend() will display legends for the lines (from text to
-    # spectrum location). So we don't add the label to artists if the user
-    # doesn't want to.
-    al = kwargs.get('add_label_to_artists', True)
-    label_u = unique_labels(line_label1) if al else [None for _ in line_label1]
-    label_u_line = [i + "_line" for i in label_u] if al else label_u
+    # Skip lines outside the x limits, and lines crowded into the same
+    # few pixels, before any artists are created.
+    keep = _select_lines(ax, lines, kwargs)
+    if keep is not None:
+        line_wave = line_wave[keep]
+        line_label1 = line_label1[keep]
+        label1_size = label1_size[keep]
+        extend = extend[keep]
+        labels = [labels[i] for i in keep]
+        label_u = [label_u[i] for i in keep]
+        label_u_line = [label_u_line[i] for i in keep]
+        arrow_tip = arrow_tip[keep]
+        box_loc = box_loc[keep]
+        nlines = len(line_wave)
+    stats.nlines = nlines
+    stats.lap('select')
 
-    if annotate_kwargs is None:
-        annotate_kwargs = {}
-    if plot_kwargs is None:
-        plot_kwargs = {}
-    ak = initial_annotate_kwargs()
-    ak.update(annotate_kwargs)
-    pk = initial_plot_kwargs()
-    pk.update(plot_kwargs)
-    # Draw boxes at initial (x, y) location.
+    # Flux at the line wavelengths.
+    line_flux = lookup(line_wave)
+    stats.lap('line_flux')
+
+    # Draw boxes at initial (x, y) location, or move the boxes of an
+    # earlier LabelSet that have the same labels. Record the artists
+    # in the registry of the Axes.
+    registry = get_label_registry(ax)
+    if registry is None:
+        registry = ax._lineid_registry = LabelRegistry()
+    registry.prune()
+    if label_set is not None:
+        # Artists that are kept are recorded again below.
+        for label, box, line in zip(label_set.labels, label_set.boxes,
+                                    label_set.lines):
+            registry.discard(label, box, line)
+        old_boxes = dict(zip(label_set.labels, label_set.boxes))
+        old_lines = dict(zip(label_set.labels, label_set.lines))
+        collection = label_set.collection
+        use_collection = collection is not None
+    else:
+        old_boxes = {}
+        old_lines = {}
+        collection = None
+        use_collection = kwargs.get('line_collection', False)
+    boxes = []
+    segments = []
+    segment_indices = []
+    segment_sources = []
+    line_artists = [None] * nlines
     for i in range(nlines):
-        ax.annotate(line_label1[i], xy=(line_wave[i], arrow_tip[i]),
-                    xytext=(box_loc[i][0],
-                            box_loc[i][1]),
-
-                    fontsize=label1_size[i],
-                    label=label_u[i],
-                    **ak)
-        if extend[i]:
-            ax.plot([line_wave[i]] * 2, [arrow_tip[i], line_flux[i]],
-                    scalex=False, scaley=False,
-                    label=label_u_line[i],
-                    **pk)
-
-    # Draw the figure so that get_window_extent() below works.
-    fig.canvas.draw()
+        box = old_boxes.pop(labels[i], None)
+        if box is None:
+            box = ax.annotate(line_label1[i],
+                              xy=(line_wave[i], arrow_tip[i]),
+                              xytext=(box_loc[i][0],
+                                      box_loc[i][1]),
+
+                              fontsize=label1_size[i],
+                              label=label_u[i],
+                              **ak)
+        else:
+            box.xy = (line_wave[i], arrow_tip[i])
+            _set_box_x(box, box_loc[i][0], box_loc[i][1])
+            box.set_fontsize(label1_size[i])
+        boxes.append(box)
+        registry.add(labels[i], box)
+        line = old_lines.pop(labels[i], None)
+        if extend[i] and use_collection:
+            segments.append([(line_wave[i], arrow_tip[i]),
+                             (line_wave[i], line_flux[i])])
+            segment_indices.append(i)
+            segment_sources.append(None if line is None else line.index)
+        elif extend[i]:
+            if line is None:
+                line, = ax.plot([line_wave[i]] * 2,
+                                [arrow_tip[i], line_flux[i]],
+                                scalex=False, scaley=False,
+                                label=label_u_line[i],
+                                **pk)
+            else:
+                line.set_data([line_wave[i]] * 2,
+                              [arrow_tip[i], line_flux[i]])
+            line_artists[i] = line
+            registry.add(labels[i], line=line)
+        elif line is not None:
+            old_lines[labels[i]] = line
+
+    # Remove the artists of labels that are no longer used.
+    for box in old_boxes.values():
+        box.remove()
+    if not use_collection:
+        for line in old_lines.values():
+            if line is not None:
+                line.remove()
+
+    if collection is not None:
+        collection.set_lines(segments, segment_sources)
+    elif segments:
+        from .line_collection import LabelLineCollection
+        collection = LabelLineCollection(segments, **pk)
+        ax.add_collection(collection, autolim=False)
+    if collection is not None:
+        for i, line in zip(segment_indices, collection.lines):
+            line_artists[i] = line
+            registry.add(labels[i], line=line)
+    stats.lap('artists')
+
+    # Text extents can be measured using the renderer of the canvas,
+    # without drawing the figure. If that is not possible, draw the
+    # figure so that get_window_extent() below works.
+    renderer = _get_renderer(fig)
+    if renderer is None:
+        fig.canvas.draw()
 
     # Get annotation boxes and convert their dimensions from display
     # coordinates to data coordinates. Specifically, we want the width
-    # in wavelength units. For each annotation box, transform the
-    # bounding box into data coordinates and extract the width.
-    ax_inv_trans = ax.transData.inverted()  # display to data
-    box_widths = []  # box width in wavelength units.
-    for box in ax.texts:
-        b_ext = box.get_window_extent()
-        box_widths.append(b_ext.transformed(ax_inv_trans).width)
-
-    # Find final x locations of boxes so that they don't overlap.
-    # Function adjust_boxes uses a direct translation of the equivalent
-    # code in lineid_plot.pro in IDLASTRO.
-    max_iter = kwargs.get('max_iter', 1000)
-    adjust_factor = kwargs.get('adjust_factor', 0.35)
-    factor_decrement = kwargs.get('factor_decrement', 3.0)
-    wlp, niter, changed = adjust_boxes(line_wave, box_widths,
-                                       np.min(wave), np.max(wave),
-                                       adjust_factor=adjust_factor,
-                                       factor_decrement=factor_decrement,
-                                       max_iter=max_iter)
+    # in wavelength units. If a cache is used, the widths in display
+    # units are obtained from it, and a box of that width, centered on
+    # the line, is transformed into data coordinates. If not, for each
+    # annotation box, transform the bounding box into data coordinates
+    # and extract the width. The widths in display units are kept for
+    # later layouts of the same labels.
+    cache = kwargs.get('extent_cache', text_extent_cache)
+    if cache is not None:
+        widths = [cache.get_width(box, renderer) for box in boxes]
+        box_widths = _display_to_data_widths(ax, line_wave, widths)
+    else:
+        ax_inv_trans = ax.transData.inverted()  # display to data
+        widths = []
+        box_widths = []  # box width in wavelength units.
+        for box in boxes:
+            b_ext = box.get_window_extent(renderer)
+            widths.append(b_ext.width)
+            box_widths.append(b_ext.transformed(ax_inv_trans).width)
+    stats.lap('measure')
+
+    # Find final x locations of boxes so that they don't overlap. The
+    # boxes can start from an earlier layout.
+    left_edge, right_edge = lookup.edges
+    initial = _initial_positions(kwargs.get('previous_layout', None),
+                                 line_wave, labels)
+    # Culling can keep different lines in different Axes, so the lines
+    # are part of the key.
+    key = (left_edge, right_edge, line_wave.tobytes(), tuple(box_widths),
+           None if initial is None else tuple(initial))
+    if layouts is not None and key in layouts:
+        wlp = layouts[key]
+    else:
+        wlp = _layout_boxes(line_wave, box_widths, left_edge, right_edge,
+                            kwargs, stats, initial)
+        if layouts is not None:
+            layouts[key] = wlp
+    stats.overlaps = _count_overlaps(wlp, box_widths)
+    stats.lap('layout')
 
     # Redraw the boxes at their new x location.
     for i in range(nlines):
-        box = ax.texts[i]
-        if hasattr(box, 'xyann'):
-            box.xyann = (wlp[i], box.xyann[1])
-        elif hasattr(box, 'xytext'):
-            box.xytext = (wlp[i], box.xytext[1])
-        else:
-            warnings.warn("Warning: missing xyann and xytext attributes. "
-                          "Your matplotlib version may not be compatible "
-                          "with lineid_plot.")
+        _set_box_x(boxes[i], wlp[i])
 
-    # Update the figure
-    fig.canvas.draw()
+    # Keep what is needed for laying out the labels again.
+    state = (ax, line_wave, labels, boxes, line_artists, line_flux, widths,
+             wlp, (left_edge, right_edge), kwargs)
+    if label_set is None:
+        label_set = LabelSet(*state)
+        # Only LabelSets that are used later are kept with the Axes.
+        if any(kwargs.get(k, False) for k in ('interactive', 'animated',
+                                              'return_handle')):
+            registry.label_sets.append(label_set)
+    else:
+        label_set._set_state(*state)
+    label_set.spectrum = spectrum
+    label_set.collection = collection
+    label_set._prepared = lines
+    if kwargs.get('interactive', False):
+        label_set.connect()
+    if kwargs.get('animated', False):
+        label_set.set_animated()
+    stats.lap('place')
+
+    # Update the figure. With interactive backends the draw is
+    # deferred until the GUI is idle.
+    if kwargs.get('draw', True):
+        fig.canvas.draw_idle()
+        stats.lap('draw')
 
     # Return Figure and Axes so that they can be used for further
     # manual customization.
     return fig, ax
+
+
+def _select_lines(ax, lines, kwargs):
+    """Indices of the lines to label, or None to label all of them."""
+    cull = kwargs.get('cull', False)
+    if cull is None:
+        cull = False
+    elif isinstance(cull, (bool, np.bool_)):
+        cull = bool(cull)
+    elif not isinstance(cull, numbers.Real):
+        raise ValueError("cull must be a boolean, None or a number, "
+                         "not {0!r}".format(cull))
+    lod_pixels = kwargs.get('lod_pixels', None)
+    if cull is False and lod_pixels is None:
+        return None
+
+    line_wave = lines['line_wave']
+    keep = np.arange(len(line_wave))
+    if cull is not False:
+        margin = 0.05 if cull is True else float(cull)
+        lo, hi = sorted(ax.get_xlim())
+        i0, i1 = cull_lines(line_wave, lo - margin * (hi - lo),
+                            hi + margin * (hi - lo))
+        keep = keep[i0:i1]
+    if lod_pixels is not None:
+        priority = lines['priority']
+        if priority is not None:
+            priority = priority[keep]
+        x = ax.transData.transform(
+            np.column_stack([line_wave[keep], np.zeros(len(keep))]))[:, 0]
+        keep = keep[thin_lines(x, lod_pixels, priority)]
+    return keep
+
+
+def _initial_positions(previous, line_wave, labels):
+    """Start locations of boxes from the LabelSet `previous`, or None.
+
+    Boxes keep their offsets from their lines in `previous`. Boxes of
+    new labels start at their lines.
+    """
+    if previous is None:
+        return None
+    offsets = dict(zip(previous.labels,
+                       (previous.positions - previous.line_wave).tolist()))
+    return np.asarray(line_wave, dtype=float) + \
+        [offsets.get(l, 0.0) for l in labels]
+
+
+def _layout_boxes(line_wave, box_widths, left_edge, right_edge, kwargs,
+                  stats=None, initial=None):
+    """Box locations using the layout keywords of `plot_line_ids`.
+
+    The iterations used, and whether they converged, are recorded in
+    the LayoutStats `stats`, if given. `initial` are the start
+    locations of the boxes for the iterative layout.
+    """
+    # Function adjust_boxes uses a direct translation of the equivalent
+    # code in lineid_plot.pro in IDLASTRO.
+    # Function place_boxes solves the same problem exactly.
+    # With clusters, independent groups of lines are laid out
+    # separately by layout_clusters.
+    layout = kwargs.get('layout', 'iterative')
+    clusters = kwargs.get('clusters', False)
+    executor = kwargs.get('executor', None)
+    if layout == 'iterative':
+        max_iter = kwargs.get('max_iter', 1000)
+        adjust_factor = kwargs.get('adjust_factor', 0.35)
+        factor_decrement = kwargs.get('factor_decrement', 3.0)
+        backend = kwargs.get('backend', 'numpy')
+        if clusters:
+            wlp, changed, niter = layout_clusters(
+                line_wave, box_widths, left_edge, right_edge,
+                executor=executor, initial=initial,
+                adjust_factor=adjust_factor,
+                factor_decrement=factor_decrement, max_iter=max_iter,
+                backend=backend)
+        else:
+            wlp, changed, niter = adjust_boxes(
+                line_wave, box_widths, left_edge, right_edge,
+                adjust_factor=adjust_factor,
+                factor_decrement=factor_decrement, max_iter=max_iter,
+                backend=backend, initial=initial)
+        if stats is not None:
+            stats.niter = niter
+            stats.converged = not changed
+    elif layout == 'exact':
+        if clusters:
+            wlp = layout_clusters(line_wave, box_widths, left_edge,
+                                  right_edge, layout='exact',
+                                  executor=executor)[0]
+        else:
+            wlp = place_boxes(line_wave, box_widths, left_edge, right_edge)
+    else:
+        raise ValueError("layout must be 'iterative' or 'exact'")
+    return wlp
+
+
+def _set_box_x(box, x, y=None):
+    """Move the text of an annotation to the x location `x`.
+
+    The y location is changed too, if `y` is given.
+    """
+    if hasattr(box, 'xyann'):
+        box.xyann = (x, box.xyann[1] if y is None else y)
+    elif hasattr(box, 'xytext'):
+        box.xytext = (x, box.xytext[1] if y is None else y)
+    else:
+        warnings.warn("Warning: missing xyann and xytext attributes. "
+                      "Your matplotlib version may not be compatible "
+                      "with lineid_plot.")
+
+
+# Keywords of plot_line_ids that apply to one call only.
+_CALL_KEYWORDS = ('previous_layout', 'flux_lookup', 'stats', 'executor',
+                  'ax', 'fig')
+
+
+class LabelSet(object):
+    """The labels placed by one call to `plot_line_ids`.
+
+    Instances that are returned as handles, or that lay out or animate
+    labels later, are kept in the `label_sets` list of the LabelRegistry
+    of the Axes. All arrays are in the order of the wave lengths of the
+    lines.
+
+    Attributes
+    ----------
+    ax: Matplotlib Axes
+        Axes in which the labels are placed.
+    line_wave: array of floats
+        Wave lengths of the lines.
+    labels: list of strings
+        Unique labels of the lines.
+    boxes: list of Annotation
+        The label boxes.
+    lines: list of Line2D, CollectionLine or None
+        Lines from the boxes to the flux level, if drawn.
+    widths: array of floats
+        Width of the boxes in display units.
+    positions: array of floats
+        Current x location of the boxes, in data units.
+    spectrum: Line2D or None
+        The plotted spectrum, if it was plotted by `plot_line_ids`.
+    collection: LabelLineCollection or None
+        Collection of the lines, if `line_collection` was used.
+
+    """
+
+    def __init__(self, ax, line_wave, labels, boxes, lines, line_flux,
+                 widths, positions, edges, kwargs):
+        self.spectrum = None
+        self.collection = None
+        self._prepared = None
+        self._cids = []
+        self._draw_cid = None
+        self._reconnect_draw = False
+        self._background = None
+        self._set_state(ax, line_wave, labels, boxes, lines, line_flux,
+                        widths, positions, edges, kwargs)
+
+    def __getstate__(self):
+        # The background is a buffer of the canvas, and the canvas is
+        # not pickled with the figure. The canvas of an unpickled figure
+        # doesn't exist yet while this is unpickled, so the draw
+        # callback is connected again when the LabelSet is next used.
+        state = self.__dict__.copy()
+        state['_background'] = None
+        state['_draw_cid'] = None
+        state['_reconnect_draw'] = (self._reconnect_draw or
+                                    self._draw_cid is not None)
+        return state
+
+    def _reconnect(self):
+        """Connect the draw callback of an unpickled LabelSet."""
+        if self._reconnect_draw:
+            self._reconnect_draw = False
+            self._draw_cid = self.ax.figure.canvas.mpl_connect(
+                'draw_event', self._on_draw)
+
+    def _in_axes(self):
+        """False if all the artists of these labels were removed."""
+        artists = self.boxes + self._flux_artists()
+        return not artists or any(a.axes is not None for a in artists)
+
+    def _set_state(self, ax, line_wave, labels, boxes, lines, line_flux,
+                   widths, positions, edges, kwargs):
+        self.ax = ax
+        self.line_wave = line_wave
+        self.labels = labels
+        self.boxes = boxes
+        self.lines = lines
+        self.line_flux = line_flux
+        self.widths = np.asarray(widths, dtype=float)
+        self.positions = np.array(positions, dtype=float)
+        self.edges = edges
+        self._layout_kwargs = dict(
+            (k, kwargs[k]) for k in ('layout', 'max_iter', 'adjust_factor',
+                                     'factor_decrement', 'backend',
+                                     'clusters')
+            if k in kwargs)
+        # Arrow tips and boxes follow the top of the Axes, unless their
+        # y locations were given.
+        self._auto_arrow_tip = "arrow_tip" not in kwargs
+        self._auto_box_loc = not kwargs.get("box_loc", None)
+        self._box_axes_space = kwargs.get("box_axes_space", 0.06)
+        # Keywords for `update`. An earlier LabelSet, the lookup of the
+        # old spectrum, executors and stats targets are not kept, so
+        # that they can be freed and the figure can be pickled. Each
+        # call to `update` reports to its own `stats` only.
+        self._kwargs = dict((k, v) for k, v in kwargs.items()
+                            if k not in _CALL_KEYWORDS)
+
+    def update(self, wave, flux, line_wave, line_label1, label1_size=None,
+               extend=True, **kwargs):
+        """Label new lines, reusing the artists of these labels.
+
+        Boxes and lines of labels that are in both the old and the new
+        lines are moved; only those of new labels are created, and
+        those of labels that are no longer present are removed. Other
+        artists in the Axes are not changed. The limits of the Axes
+        are not changed either.
+
+        Parameters
+        ----------
+        wave, flux, line_wave, line_label1, label1_size, extend:
+            As for `plot_line_ids`. If the spectrum was plotted by
+            `plot_line_ids`, then it is replaced with `wave` and
+            `flux`.
+        kwargs: key value pairs
+            Keywords of `plot_line_ids` that replace those used
+            before. Keywords with one value for each line, such as
+            `arrow_tip` and `priority`, must be given again if the
+            number of lines changes. `stats` and `executor` are not
+            kept from earlier calls. By default, the layout starts
+            from the current one; see `previous_layout`.
+
+        Returns
+        -------
+        stats: LayoutStats
+            Timings and results of the layout.
+
+        """
+        new_kwargs = dict(self._kwargs, previous_layout=self)
+        new_kwargs.update(kwargs)
+        kwargs = new_kwargs
+        stats = LayoutStats()
+        lines = _prepare_lines(
+            line_wave, line_label1, label1_size, extend,
+            self._prepared['annotate_kwargs'],
+            self._prepared['plot_kwargs'],
+            kwargs.get('add_label_to_artists', True),
+            kwargs.get('priority', None))
+        stats.lap('prepare_lines')
+        _label_axes(wave, flux, lines, kwargs, stats=stats, label_set=self)
+        _report_stats(stats, kwargs)
+        return stats
+
+    def relayout(self, *args):
+        """Lay out the labels of the lines within the x limits again.
+
+        Box widths are converted from display units, so the layout is
+        correct for the current limits and size of the Axes. Only the
+        boxes of lines within the x limits are moved; the others are not
+        drawn. Accepts, and ignores, the arguments passed by Matplotlib
+        callbacks.
+        """
+        ax = self.ax
+        lo, hi = sorted(ax.get_xlim())
+        i0 = np.searchsorted(self.line_wave, lo, side='left')
+        i1 = np.searchsorted(self.line_wave, hi, side='right')
+        if i0 >= i1:
+            return
+
+        line_wave = self.line_wave[i0:i1]
+        box_widths = _display_to_data_widths(ax, line_wave,
+                                             self.widths[i0:i1])
+        left_edge = max(lo, self.edges[0])
+        right_edge = min(hi, self.edges[1])
+        wlp = _layout_boxes(line_wave, box_widths, left_edge, right_edge,
+                            self._layout_kwargs)
+        self.positions[i0:i1] = wlp
+
+        if self._auto_arrow_tip:
+            arrow_tip = np.full(i1 - i0, ax.get_ybound()[1])
+        else:
+            arrow_tip = np.array([box.xy[1] for box in self.boxes[i0:i1]])
+        if self._auto_box_loc:
+            box_y = get_box_loc(ax.figure, ax, line_wave, arrow_tip,
+                                self._box_axes_space)[:, 1]
+        for j, i in enumerate(range(i0, i1)):
+            box = self.boxes[i]
+            _set_box_x(box, wlp[j])
+            if self._auto_arrow_tip:
+                box.xy = (box.xy[0], arrow_tip[j])
+                line = self.lines[i]
+                if line is not None:
+                    line.set_data([line_wave[j]] * 2,
+                                  [arrow_tip[j], self.line_flux[i]])
+            if self._auto_box_loc and hasattr(box, 'xyann'):
+                box.xyann = (box.xyann[0], box_y[j])
+
+    def connect(self):
+        """Lay out the labels again after zooming, panning or resizing.
+
+        The layout is updated from the x and y limit callbacks of the
+        Axes and the resize event of the canvas. The boxes are moved in
+        place; they are drawn by the draw that follows the change.
+        """
+        if self._cids:
+            return
+        ax = self.ax
+        self._cids = [
+            (ax.callbacks, ax.callbacks.connect('xlim_changed',
+                                                self.relayout)),
+            (ax.callbacks, ax.callbacks.connect('ylim_changed',
+                                                self.relayout)),
+            (ax.figure.canvas, ax.figure.canvas.mpl_connect(
+                'resize_event', self.relayout)),
+        ]
+
+    def disconnect(self):
+        """Stop laying out the labels after changes to the Axes."""
+        for source, cid in self._cids:
+            if hasattr(source, 'mpl_disconnect'):
+                source.mpl_disconnect(cid)
+            else:
+                source.disconnect(cid)
+        self._cids = []
+
+    def _flux_artists(self):
+        """The spectrum, if plotted here, and the lines to the flux."""
+        artists = []
+        if self.spectrum is not None:
+            artists.append(self.spectrum)
+        if self.collection is not None:
+            artists.append(self.collection)
+        else:
+            artists.extend(l for l in self.lines if l is not None)
+        return artists
+
+    @property
+    def animated_artists(self):
+        """Artists of these labels that are drawn only by blitting."""
+        return [a for a in self._flux_artists() + self.boxes
+                if a.get_animated()]
+
+    def set_animated(self, animated=True, labels=False):
+        """Mark the artists that change with the flux as animated.
+
+        The spectrum, if it was plotted by `plot_line_ids`, and the
+        lines from the boxes to the flux are animated; the boxes are
+        animated too if `labels` is True. Animated artists are not
+        drawn by a normal draw of the figure. Instead, after each full
+        draw the rest of the figure is kept as a background, and `blit`
+        draws the animated artists over it.
+
+        Returns
+        -------
+        artists: list of artists
+            The animated artists, for example to be returned by the
+            function passed to `matplotlib.animation.FuncAnimation`
+            with ``blit=True``.
+
+        """
+        self._reconnect()
+        for artist in self._flux_artists():
+            artist.set_animated(animated)
+        for box in self.boxes:
+            box.set_animated(animated and labels)
+
+        canvas = self.ax.figure.canvas
+        if animated and self._draw_cid is None:
+            self._draw_cid = canvas.mpl_connect('draw_event',
+                                                self._on_draw)
+        elif not animated and self._draw_cid is not None:
+            canvas.mpl_disconnect(self._draw_cid)
+            self._draw_cid = None
+            self._background = None
+        return self.animated_artists
+
+    def _on_draw(self, event):
+        """Keep the background after a full draw, then add the rest.
+
+        Canvases that can't blit, such as those used for saving to
+        vector formats, are skipped.
+        """
+        canvas = event.canvas
+        if not hasattr(canvas, 'copy_from_bbox'):
+            return
+        self._background = canvas.copy_from_bbox(self.ax.figure.bbox)
+        for artist in self.animated_artists:
+            self.ax.draw_artist(artist)
+
+    def update_flux(self, wave, flux):
+        """Change the spectrum without changing the layout of labels.
+
+        The spectrum, if it was plotted by `plot_line_ids`, and the
+        lines from the boxes to the flux are updated. Nothing is drawn.
+
+        Returns
+        -------
+        artists: list of artists
+            The artists that were changed.
+
+        """
+        self._reconnect()
+        lookup = LineFluxLookup(wave, flux)
+        self.line_flux = lookup(self.line_wave)
+        changed = []
+        if self.spectrum is not None:
+            wave, flux = lookup.get_sorted()
+            self.spectrum.set_data(*_decimate_for_axes(
+                self.ax, wave, flux, self._kwargs.get('decimate', False)))
+            changed.append(self.spectrum)
+        for box, line, f in zip(self.boxes, self.lines,
+                                self.line_flux.tolist()):
+            if line is not None:
+                x = line.get_data()[0]
+                line.set_data(x, [box.xy[1], f])
+                if self.collection is None:
+                    changed.append(line)
+        if self.collection is not None:
+            changed.append(self.collection)
+        return changed
+
+    def blit(self):
+        """Draw the animated artists over the cached background.
+
+        If there is no background yet, then the whole figure is drawn.
+        """
+        self._reconnect()
+        canvas = self.ax.figure.canvas
+        if self._background is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self._background)
+        for artist in self.animated_artists:
+            self.ax.draw_artist(artist)
+        canvas.blit(self.ax.figure.bbox)
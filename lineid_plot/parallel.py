@@ -0,0 +1,108 @@
+"""Render labelled spectra to image files using a pool of processes.
+
+Matplotlib's pyplot state is not thread safe, so spectra are rendered
+in separate processes. Each worker creates figures with the Agg canvas
+directly, without going through pyplot, and so doesn't depend on the
+backend selected in the parent process.
+"""
+from __future__ import division, print_function
+
+import multiprocessing
+import time
+import traceback
+from collections import namedtuple
+
+__all__ = ['RenderResult', 'render_to_files']
+
+RenderResult = namedtuple('RenderResult',
+                          ['index', 'filename', 'seconds', 'error'])
+RenderResult.__doc__ = """Outcome of rendering one job.
+
+index: position of the job in the list of jobs.
+filename: name of the image file.
+seconds: wall clock time taken to render and save the figure.
+error: traceback as a string, if the job failed, else None.
+"""
+
+
+def _render(indexed_job):
+    """Render one job to a file; runs in a worker process."""
+    index, job = indexed_job
+    start = time.time()
+    filename = job.get('filename')
+    try:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from lineid_plot import plot_line_ids
+
+        job = dict(job)
+        wave = job.pop('wave')
+        flux = job.pop('flux')
+        line_wave = job.pop('line_wave')
+        line_label1 = job.pop('line_label1')
+        job.pop('filename')
+        savefig_kwargs = job.pop('savefig_kwargs', {})
+        fig = Figure(**job.pop('figure_kwargs', {}))
+        FigureCanvasAgg(fig)
+        plot_line_ids(wave, flux, line_wave, line_label1, fig=fig,
+                      draw=False, **job)
+        fig.savefig(filename, **savefig_kwargs)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+
+    return RenderResult(index, filename, time.time() - start, error)
+
+
+def render_to_files(jobs, processes=None, chunksize=None, context=None):
+    """Plot and save many labelled spectra in parallel.
+
+    Parameters
+    ----------
+    jobs: sequence of dicts
+        Each dict must have the keys 'wave', 'flux', 'line_wave',
+        'line_label1' and 'filename'. Optional keys 'figure_kwargs'
+        and 'savefig_kwargs' are passed to `matplotlib.figure.Figure`
+        and `Figure.savefig` respectively. All other keys are passed
+        to `plot_line_ids`.
+    processes: int
+        Number of worker processes. The default is the number of CPUs.
+        If 1 then the jobs are rendered in the calling process.
+    chunksize: int
+        Number of jobs sent to a worker at a time. The default splits
+        the jobs into about four chunks per worker.
+    context: str
+        Multiprocessing start method, for example 'spawn'. The default
+        is the platform default. Requires Python 3.4 or later.
+
+    Returns
+    -------
+    results: list of RenderResult
+        One result for each job, in the order of `jobs`. A job that
+        raises an exception has the traceback in its `error` field; it
+        does not stop the other jobs.
+
+    """
+    jobs = list(enumerate(jobs))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes == 1:
+        return [_render(job) for job in jobs]
+
+    if chunksize is None:
+        chunksize, extra = divmod(len(jobs), processes * 4)
+        if extra or not chunksize:
+            chunksize += 1
+
+    # get_context is only available in Python 3.4 and later.
+    if context is not None:
+        pool = multiprocessing.get_context(context).Pool(processes)
+    else:
+        pool = multiprocessing.Pool(processes)
+    try:
+        results = list(pool.imap(_render, jobs, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
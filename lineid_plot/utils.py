@@ -1,5 +1,6 @@
 """Some utility functions."""
 import matplotlib as mpl
+import numpy as np
 import lineid_plot
 from lineid_plot import unique_labels
 
@@ -11,74 +12,141 @@ def get_labels(labels):
     return label_u, label_u_line
 
 
-def get_boxes_and_lines(ax, labels):
-    """Get boxes and lines using labels as id."""
-    labels_u, labels_u_line = get_labels(labels)
-    boxes = ax.findobj(mpl.text.Annotation)
-    lines = ax.findobj(mpl.lines.Line2D)
-    lineid_boxes = []
-    lineid_lines = []
-
-    for box in boxes:
+def _find_boxes_and_lines(ax, labels_u):
+    """Dicts mapping unique labels to lists of boxes and of lines in `ax`.
+
+    The artists are looked up in the LabelRegistry of `ax`, skipping
+    those that were removed from the Axes. If there is no registry, for
+    example for an Axes labelled by an earlier version of lineid_plot
+    and then unpickled, then the artists are found using their label
+    property.
+    """
+    registry = lineid_plot.get_label_registry(ax)
+    if registry is not None:
+        found = []
+        for artists in (registry.boxes, registry.lines):
+            live = {}
+            for l in labels_u:
+                kept = [a for a in artists.get(l, ()) if a.axes is not None]
+                if kept:
+                    live[l] = kept
+            found.append(live)
+        return found[0], found[1]
+
+    wanted = set(labels_u)
+    boxes = {}
+    lines = {}
+    for box in ax.findobj(mpl.text.Annotation):
         l = box.get_label()
-        try:
-            loc = labels_u.index(l)
-        except ValueError:
-            # this box is either one not added by lineidplot or has no label.
-            continue
-        lineid_boxes.append(box)
-
-    for line in lines:
+        if l in wanted:
+            boxes.setdefault(l, []).append(box)
+    for line in ax.findobj(mpl.lines.Line2D):
         l = line.get_label()
-        try:
-            loc = labels_u_line.index(l)
-        except ValueError:
-            # this line is either one not added by lineidplot or has no label.
-            continue
-        lineid_lines.append(line)
+        if l.endswith("_line") and l[:-len("_line")] in wanted:
+            lines.setdefault(l[:-len("_line")], []).append(line)
+    return boxes, lines
+
+
+def get_boxes_and_lines(ax, labels):
+    """Get boxes and lines using labels as id.
+
+    The boxes and lines are returned in the order of `labels`, and for
+    each label in the order in which they were created. Labels without
+    a box, or a line, are skipped.
+    """
+    labels_u = unique_labels(labels)
+    boxes, lines = _find_boxes_and_lines(ax, labels_u)
+    lineid_boxes = [b for l in labels_u for b in boxes.get(l, ())]
+    lineid_lines = [i for l in labels_u for i in lines.get(l, ())]
 
     return lineid_boxes, lineid_lines
 
 
+def _per_label(value, n):
+    """List with one value per label; lists and arrays are per label."""
+    if isinstance(value, (list, np.ndarray)):
+        assert len(value) == n, \
+            "Equal no. of values and lables must be given"
+        return list(value)
+    return [value] * n
+
+
+def style_labels(ax, labels, color=None, fontsize=None, visible=None,
+                 linecolor=None, linestyle=None, linewidth=None,
+                 color_arrow=True, draw=False):
+    """Change the appearance of many boxes and lines at once.
+
+    Parameters
+    ----------
+    ax: Matplotlib Axes
+        Axes in which the labels were placed by `plot_line_ids`.
+    labels: list of strings
+        Label texts, as given to `plot_line_ids`. Unique labels are
+        created from these using `unique_labels`.
+    color, fontsize: values for the text boxes
+        Text color and font size.
+    visible: boolean
+        Visibility of both the box and the line of each label.
+    linecolor, linestyle, linewidth: values for the lines
+        Color, style and width of the lines from the boxes to the
+        spectrum.
+    color_arrow: boolean
+        If True (default) then `color` is also applied to the short
+        line in the annotation.
+    draw: boolean
+        If True then request a single redraw of the figure once all
+        changes are made. Default is False.
+
+    Each property can be a list, or array, with one value for each
+    label, or a single value that is used for all labels. Tuples are
+    treated as single values, so that RGB colors can be given. A
+    property, or a value in a list, that is None is not changed.
+
+    """
+    labels_u = unique_labels(labels)
+    n = len(labels_u)
+    boxes, lines = _find_boxes_and_lines(ax, labels_u)
+
+    box_props = [("color", color), ("fontsize", fontsize),
+                 ("visible", visible)]
+    line_props = [("color", linecolor), ("linestyle", linestyle),
+                  ("linewidth", linewidth), ("visible", visible)]
+    for artists, props in ((boxes, box_props), (lines, line_props)):
+        for name, value in props:
+            if value is None:
+                continue
+            for l, v in zip(labels_u, _per_label(value, n)):
+                if v is None:
+                    continue
+                for artist in artists.get(l, ()):
+                    artist.set(**{name: v})
+                    if name == "color" and artists is boxes and color_arrow:
+                        artist.arrow_patch.set_color(v)
+
+    if draw:
+        ax.figure.canvas.draw_idle()
+
+
 def color_text_boxes(ax, labels, colors, color_arrow=True):
     """Color text boxes.
 
     Instead of this function, one can pass annotate_kwargs and plot_kwargs to
-    plot_line_ids function.
+    plot_line_ids function. Use `style_labels` to make several changes
+    with a single redraw.
     """
     assert len(labels) == len(colors), \
         "Equal no. of colors and lables must be given"
-    boxes = ax.findobj(mpl.text.Annotation)
-    box_labels = lineid_plot.unique_labels(labels)
-    for box in boxes:
-        l = box.get_label()
-        try:
-            loc = box_labels.index(l)
-        except ValueError:
-            continue  # No changes for this box
-        box.set_color(colors[loc])
-        if color_arrow:
-            box.arrow_patch.set_color(colors[loc])
-
-    ax.figure.canvas.draw()
+    style_labels(ax, labels, color=list(colors), color_arrow=color_arrow,
+                 draw=True)
 
 
 def color_lines(ax, labels, colors):
     """Color lines.
 
     Instead of this function, one can pass annotate_kwargs and plot_kwargs to
-    plot_line_ids function.
+    plot_line_ids function. Use `style_labels` to make several changes
+    with a single redraw.
     """
     assert len(labels) == len(colors), \
         "Equal no. of colors and lables must be given"
-    lines = ax.findobj(mpl.lines.Line2D)
-    line_labels = [i + "_line" for i in lineid_plot.unique_labels(labels)]
-    for line in lines:
-        l = line.get_label()
-        try:
-            loc = line_labels.index(l)
-        except ValueError:
-            continue  # No changes for this line
-        line.set_color(colors[loc])
-
-    ax.figure.canvas.draw()
+    style_labels(ax, labels, linecolor=list(colors), draw=True)
@@ -0,0 +1,64 @@
+"""Tests for lineid_plot.layout."""
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.text import Text
+
+import lineid_plot
+from lineid_plot.layout import estimate_text_widths, layout_labels
+
+RFLUX = np.random.RandomState(seed=123).normal(size=300)
+
+
+def _text_width(box, renderer):
+    """Width of the text of an annotation, without the arrow."""
+    return Text.get_window_extent(box, renderer).width
+
+
+def test_estimate_text_widths():
+    """Estimated widths match the widths of drawn labels."""
+    labels = ['N V', 'Si II', 'Ly$\\alpha$', 'Fe II\n1608']
+    fig, ax = lineid_plot.plot_line_ids(
+        1240 + np.arange(300) * 0.1, RFLUX, [1245, 1250, 1255, 1260], labels,
+        label1_size=[12, 12, 16, 12], extent_cache=None)
+    fig.canvas.draw()
+    renderer = fig.canvas.get_renderer()
+    measured = [_text_width(b, renderer) for b in ax.texts]
+    plt.close(fig)
+
+    widths = estimate_text_widths(labels, [12, 12, 16, 12], dpi=fig.dpi)
+    # Single line labels are exact to a pixel; multi-line ones are
+    # approximate, see the Notes of estimate_text_widths.
+    assert np.allclose(widths[:3], measured[:3], atol=1.0, rtol=0)
+    assert np.allclose(widths[3], measured[3], atol=1.0, rtol=0.1)
+    assert np.allclose(estimate_text_widths(['N V'], rotation=0, dpi=100),
+                       [30], atol=1.0)
+
+
+def test_layout_labels():
+    """Same locations as the labels placed by plot_line_ids."""
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1260.42, 1242.80, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['Si II', 'N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(wave, RFLUX, line_wave, line_label1,
+                                        layout='exact')
+    expected = [b.xyann[0] for b in ax.texts]
+    positions, box_widths = layout_labels(
+        line_wave, line_label1, ax.get_xlim(), ax.bbox.width, dpi=fig.dpi,
+        edges=(wave[0], wave[-1]), layout='exact')
+    plt.close(fig)
+
+    order = np.argsort(line_wave)
+    assert np.allclose(positions[order], expected, atol=0.05)
+    assert np.all(np.diff(positions[order]) >=
+                  (box_widths[order][1:] + box_widths[order][:-1]) / 2 - 1e-9)
+
+
+def test_layout_labels_initial():
+    """Starting from earlier positions converges to the same layout."""
+    line_wave = [1260.42, 1242.80, 1264.74, 1265.00, 1265.2, 1265.3]
+    labels = ['Si II', 'N V', 'Si II', 'Si II', 'Si II', 'Si II']
+    positions, _ = layout_labels(line_wave, labels, (1240, 1270), 500.0)
+    again, _ = layout_labels(line_wave, labels, (1240, 1270), 500.0,
+                             initial=positions)
+    assert np.all(again == positions)
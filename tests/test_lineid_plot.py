@@ -15,6 +15,14 @@ def test_unique_labels():
     x = ['N V', 'Si II_num_1', 'Si II_num_2', 'Si II_num_3', 'Si II_num_4',
          'Si II_num_5', 'Si II_num_6']
     assert lineid_plot.unique_labels(line_label1) == x
+    assert lineid_plot.unique_labels(np.array(line_label1)) == x
+
+
+def test_unique_labels_interleaved():
+    """Suffixes follow the order of occurrence of each label."""
+    line_label1 = ['A', 'B', 'A', 'C', 'B', 'A']
+    x = ['A_num_1', 'B_num_1', 'A_num_2', 'C', 'B_num_2', 'A_num_3']
+    assert lineid_plot.unique_labels(line_label1) == x
 
 
 @pytest.mark.mpl_image_compare
@@ -279,3 +287,854 @@ def test_dont_add_label_to_artists():
     for label in labels:
         assert fig.findobj(match=lambda x: x.get_label() == label) == []
         assert fig.findobj(match=lambda x: x.get_label() == label + "_line") == []
+
+
+def _adjust_boxes_cases():
+    line_wave = np.array(
+        [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35])
+    box_widths = np.array([0.62, 0.66, 0.66, 0.66, 0.66, 0.66, 0.66])
+    rs = np.random.RandomState(seed=42)
+    cases = [(line_wave, box_widths, 1240.0, 1269.9)]
+    for n in (1, 2, 3, 50, 200):
+        w = np.sort(rs.uniform(0, 100, size=n))
+        cases.append((w, rs.uniform(0.5, 3.0, size=n), 0.0, 100.0))
+    return cases
+
+
+def _check_backend_matches_python(backend):
+    for w, b, left, right in _adjust_boxes_cases():
+        for max_iter in (10, 300, 1000):
+            ref = lineid_plot.adjust_boxes(
+                list(w), list(b), left, right, max_iter=max_iter,
+                backend='python')
+            vec = lineid_plot.adjust_boxes(
+                w, b, left, right, max_iter=max_iter, backend=backend)
+            assert np.array_equal(ref[0], vec[0])
+            assert ref[1:] == vec[1:]
+
+
+def test_adjust_boxes_backends_match():
+    """The numpy and python backends must give identical results."""
+    _check_backend_matches_python('numpy')
+
+
+def test_adjust_boxes_numba_backend():
+    """The compiled backend gives the results of the reference loop."""
+    pytest.importorskip("numba")
+    _check_backend_matches_python('numba')
+
+
+def test_adjust_boxes_numba_fallback(monkeypatch):
+    """Without Numba the reference implementation is used."""
+    import sys
+    monkeypatch.setitem(sys.modules, "numba", None)
+    monkeypatch.setattr(lineid_plot.lineid_plot, "_numba_loop", None)
+    w, b, left, right = _adjust_boxes_cases()[0]
+    with pytest.warns(UserWarning, match="Numba is not installed"):
+        result = lineid_plot.adjust_boxes(w, b, left, right,
+                                          backend='numba')
+    ref = lineid_plot.adjust_boxes(w, b, left, right, backend='python')
+    assert np.array_equal(result[0], ref[0])
+    assert result[1:] == ref[1:]
+
+
+def test_adjust_boxes_unknown_backend():
+    """Unknown backends must be rejected."""
+    with pytest.raises(ValueError):
+        lineid_plot.adjust_boxes([1.0], [0.1], 0.0, 2.0, backend='idl')
+
+
+def test_place_boxes():
+    """Boxes must not overlap and must stay between the edges."""
+    rs = np.random.RandomState(seed=42)
+    line_wave = rs.uniform(0, 100, size=500)
+    box_widths = rs.uniform(0.05, 0.3, size=500)
+    wlp = lineid_plot.place_boxes(line_wave, box_widths, 0.0, 100.0)
+
+    indx = np.argsort(line_wave)
+    x, w = wlp[indx], box_widths[indx]
+    assert np.all(np.diff(x) >= (w[1:] + w[:-1]) / 2.0 - 1e-9)
+    assert x[0] - w[0] / 2.0 >= -1e-9
+    assert x[-1] + w[-1] / 2.0 <= 100.0 + 1e-9
+
+    # Boxes that don't overlap are not moved.
+    wlp = lineid_plot.place_boxes([1.0, 3.0, 2.0], [0.5, 0.5, 0.5], 0, 4)
+    assert np.allclose(wlp, [1.0, 3.0, 2.0])
+
+    # Overlapping boxes are moved symmetrically.
+    wlp = lineid_plot.place_boxes([1.9, 2.1], [1.0, 1.0], 0, 4)
+    assert np.allclose(wlp, [1.5, 2.5])
+
+
+def test_place_boxes_too_wide():
+    """Boxes that don't fit are centered between the edges."""
+    wlp = lineid_plot.place_boxes([0.0, 0.1, 0.2], [1.0, 1.0, 1.0], 0, 2)
+    assert np.allclose(wlp, [0.0, 1.0, 2.0])
+
+
+def test_exact_layout():
+    """Exact layout must leave no label boxes overlapping."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, layout='exact')
+
+    renderer = fig.canvas.get_renderer()
+    extents = sorted(
+        tuple(mpl.text.Text.get_window_extent(box, renderer).intervalx)
+        for box in ax.texts)
+    for left, right in zip(extents[:-1], extents[1:]):
+        assert left[1] <= right[0] + 1e-6
+    plt.close(fig)
+
+
+def test_no_draw():
+    """Labels can be placed without drawing the figure."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1)
+    expected = [box.xyann for box in ax.texts]
+
+    ndraws = []
+    fig1 = plt.figure()
+    draw = fig1.canvas.draw
+    fig1.canvas.draw = lambda *args: ndraws.append(1) or draw(*args)
+    fig1, ax1 = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, fig=fig1, draw=False)
+
+    assert ndraws == []
+    assert [box.xyann for box in ax1.texts] == expected
+    plt.close(fig)
+    plt.close(fig1)
+
+
+def test_text_extent_cache():
+    """Label widths are measured once and then reused."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, extent_cache=None)
+    expected = [box.xyann for box in ax.texts]
+
+    cache = lineid_plot.TextExtentCache(maxsize=1)
+    fig1, ax1 = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, extent_cache=cache)
+    assert [box.xyann for box in ax1.texts] == pytest.approx(expected)
+    assert (cache.hits, cache.misses, len(cache)) == (5, 2, 1)
+
+    # Only one width is kept, so both labels are measured again.
+    fig2, ax2 = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, extent_cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (10, 4, 1)
+
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+    plt.close(fig)
+    plt.close(fig1)
+    plt.close(fig2)
+
+
+@pytest.mark.mpl_image_compare(filename='test_multi_plot_user_axes.png')
+def test_batch_multi_plot_user_axes():
+    """Many Axes can be labelled in one call."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig = plt.figure()
+
+    ax = fig.add_axes([0.1, 0.06, 0.85, 0.35])
+    ax.plot(wave, flux)
+
+    ax1 = fig.add_axes([0.1, 0.55, 0.85, 0.35])
+    ax1.plot(wave, flux)
+
+    figs_and_axes = lineid_plot.plot_line_ids_batch(
+        [(wave, flux, ax), (wave, flux, ax1)], line_wave, line_label1)
+    assert figs_and_axes == [(fig, ax), (fig, ax1)]
+
+    return fig
+
+
+def test_axes_with_other_texts():
+    """Only the labels created by plot_line_ids are moved."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1)
+    expected = [box.xyann for box in ax.texts]
+
+    fig1 = plt.figure()
+    ax1 = fig1.add_axes([0.1, 0.1, 0.85, 0.65])
+    ax1.plot(wave, flux)
+    note = ax1.text(1250, 0, "note")
+    lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1, ax=ax1)
+
+    assert note.get_position() == (1250, 0)
+    assert [box.xyann for box in ax1.texts[1:]] == expected
+    plt.close(fig)
+    plt.close(fig1)
+
+
+def test_get_box_loc():
+    """Box locations are the arrow tips moved up in figure fraction."""
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.set_yscale('log')
+    ax.axis([1240, 1270, 0.1, 10])
+    line_wave = [1242.80, 1260.42, 1265.35]
+    arrow_tip = [1.0, 2.0, 3.0]
+
+    box_loc = lineid_plot.get_box_loc(fig, ax, line_wave, arrow_tip, 0.06)
+
+    assert box_loc.shape == (3, 2)
+    for (w, a), loc in zip(zip(line_wave, arrow_tip), box_loc):
+        x, y = fig.transFigure.inverted().transform(
+            ax.transData.transform((w, a)))
+        expected = ax.transData.inverted().transform(
+            fig.transFigure.transform((x, y + 0.06)))
+        assert loc == pytest.approx(expected)
+    plt.close(fig)
+
+
+def test_input_arrays_not_modified():
+    """Unsorted and read-only inputs are accepted and left unchanged."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1)
+    expected = sorted(box.xyann for box in ax.texts)
+
+    wave1, flux1 = wave[::-1].copy(), flux[::-1].copy()
+    line_wave1 = np.array(line_wave[::-1])
+    for x in (wave1, flux1, line_wave1):
+        x.setflags(write=False)
+    fig1, ax1 = lineid_plot.plot_line_ids(
+        wave1, flux1, line_wave1, line_label1[::-1])
+
+    assert sorted(box.xyann for box in ax1.texts) == expected
+    assert np.array_equal(wave1, wave[::-1])
+    assert np.array_equal(flux1, flux[::-1])
+    assert np.array_equal(line_wave1, line_wave[::-1])
+    plt.close(fig)
+    plt.close(fig1)
+
+
+def test_adjust_boxes_does_not_modify_input():
+    """The reference backend must not change the input array."""
+    line_wave = np.array([1.0, 1.01, 1.02])
+    wlp, changed, niter = lineid_plot.adjust_boxes(
+        line_wave, [0.1, 0.1, 0.1], 0.0, 2.0, backend='python')
+    assert np.array_equal(line_wave, [1.0, 1.01, 1.02])
+    assert not np.array_equal(wlp, line_wave)
+
+
+def test_decimate_minmax():
+    """Decimation keeps the extremes of each bin and the end points."""
+    rs = np.random.RandomState(seed=42)
+    wave = np.arange(10003, dtype=float)
+    flux = rs.normal(size=10003)
+    flux[5000] = -50.0  # A narrow absorption line.
+
+    w, f = lineid_plot.decimate_minmax(wave, flux, 100)
+
+    assert len(w) <= 2 * 101 + 2
+    assert np.all(np.diff(w) > 0)
+    assert (w[0], w[-1]) == (wave[0], wave[-1])
+    assert f.min() == -50.0 and f.max() == flux.max()
+    assert np.array_equal(f, flux[w.astype(int)])
+
+    # Short spectra are not changed.
+    w, f = lineid_plot.decimate_minmax(wave[:100], flux[:100], 100)
+    assert len(w) == 100
+
+    # Bins are equal in wave length, also for unevenly spaced samples.
+    wave = np.concatenate([np.arange(1000.0), 5000 + np.arange(9003.0)])
+    w, f = lineid_plot.decimate_minmax(wave, flux, 100)
+    bins = np.minimum(((wave - wave[0]) / (wave[-1] - wave[0]) *
+                       100).astype(int), 99)
+    kept = np.minimum(((w - wave[0]) / (wave[-1] - wave[0]) *
+                       100).astype(int), 99)
+    for k in np.unique(bins):
+        assert f[kept == k].min() == flux[bins == k].min()
+        assert f[kept == k].max() == flux[bins == k].max()
+
+
+def test_decimate_plot():
+    """Decimated plots have about two points per pixel column."""
+    wave = 1240 + np.arange(100000) * 0.0003
+    flux = np.random.RandomState(seed=123).normal(size=100000)
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, decimate=True)
+
+    x, y = ax.lines[0].get_data()
+    assert len(x) <= 2 * np.ceil(ax.bbox.width) + 4
+    assert (y.min(), y.max()) == (flux.min(), flux.max())
+    plt.close(fig)
+
+
+def test_line_flux_lookup(tmpdir):
+    """Lookups must match np.interp for any kind of input."""
+    rs = np.random.RandomState(seed=42)
+    wave = np.sort(rs.uniform(1000, 2000, size=1000))
+    flux = rs.normal(size=1000)
+    line_wave = np.concatenate([rs.uniform(990, 2010, size=200),
+                                wave[::50], [wave[0], wave[-1]]])
+    expected = np.interp(line_wave, wave, flux)
+
+    lookup = lineid_plot.LineFluxLookup(wave, flux)
+    assert np.allclose(lookup(line_wave), expected, rtol=0, atol=1e-12)
+    assert lookup.edges == (wave[0], wave[-1])
+
+    indx = rs.permutation(1000)
+    lookup = lineid_plot.LineFluxLookup(wave[indx], flux[indx])
+    assert np.allclose(lookup(line_wave), expected, rtol=0, atol=1e-12)
+
+    chunks = [0, 10, 500, 999, 1000]
+    lookup = lineid_plot.LineFluxLookup(
+        [wave[i:j] for i, j in zip(chunks[:-1], chunks[1:])],
+        [flux[i:j] for i, j in zip(chunks[:-1], chunks[1:])])
+    assert np.allclose(lookup(line_wave), expected, rtol=0, atol=1e-12)
+
+    filename = str(tmpdir.join("wave.dat"))
+    mm = np.memmap(filename, dtype=float, mode="w+", shape=wave.shape)
+    mm[:] = wave
+    lookup = lineid_plot.LineFluxLookup(mm, flux)
+    assert np.shares_memory(lookup.get_sorted()[0], mm)
+    assert np.allclose(lookup(line_wave), expected, rtol=0, atol=1e-12)
+
+
+def test_line_flux_lookup_dtypes():
+    """Wave lengths are not truncated to the dtype of the spectrum."""
+    rs = np.random.RandomState(seed=42)
+    line_wave = rs.uniform(-60, 60, size=200)
+    for wave in (np.arange(-50, 50), np.linspace(-50, 50, 1000,
+                                                  dtype=np.float32)):
+        flux = rs.normal(size=len(wave))
+        expected = np.interp(line_wave, wave, flux)
+        lookup = lineid_plot.LineFluxLookup(wave, flux)
+        assert np.allclose(lookup(line_wave), expected, rtol=0, atol=1e-6)
+
+
+def test_flux_lookup_keyword():
+    """A lookup can be reused for many plots of the same spectrum."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1)
+    lookup = lineid_plot.LineFluxLookup(wave[::-1], flux[::-1])
+    fig1, ax1 = lineid_plot.plot_line_ids(
+        None, None, line_wave, line_label1, flux_lookup=lookup)
+
+    assert [box.xyann for box in ax1.texts] == \
+        [box.xyann for box in ax.texts]
+    assert np.array_equal(ax1.lines[1].get_ydata(), ax.lines[1].get_ydata())
+    plt.close(fig)
+    plt.close(fig1)
+
+
+@pytest.mark.mpl_image_compare(filename='test_minimal_plot.png')
+def test_line_collection():
+    """Extension lines can be drawn as one collection."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, line_collection=True)
+
+    assert len(ax.lines) == 1
+    assert len(ax.collections) == 1
+    return fig
+
+
+def test_interactive_relayout():
+    """Zooming lays out the labels in view again without new artists."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, interactive=True)
+    fig.canvas.draw()
+    label_set = lineid_plot.get_label_registry(ax).label_sets[0]
+    before = label_set.positions.copy()
+    n_texts, n_lines = len(ax.texts), len(ax.lines)
+
+    ax.set_xlim(1264, 1266)
+    fig.canvas.draw()
+
+    assert (len(ax.texts), len(ax.lines)) == (n_texts, n_lines)
+    assert np.all(label_set.positions[:2] == before[:2])
+    boxes = label_set.boxes[2:]
+    renderer = fig.canvas.get_renderer()
+    extents = [b.get_window_extent(renderer) for b in boxes]
+    assert all(1264 <= b.xyann[0] <= 1266 for b in boxes)
+    for e1, e2 in zip(extents[:-1], extents[1:]):
+        assert e1.x1 <= e2.x0 + 1e-6
+
+    label_set.disconnect()
+    ax.set_xlim(1240, 1270)
+    assert np.all(label_set.positions[2:] == [b.xyann[0] for b in boxes])
+    plt.close(fig)
+
+
+def test_cull_and_thin_lines():
+    line_wave = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert lineid_plot.cull_lines(line_wave, 2.0, 4.5) == (1, 4)
+    assert lineid_plot.cull_lines(line_wave, 6.0, 7.0) == (5, 5)
+
+    x = [0.0, 3.0, 9.0, 12.0, 25.0]
+    assert list(lineid_plot.thin_lines(x, 10.0)) == [0, 3, 4]
+    priority = [1, 5, 2, 0, 1]
+    assert list(lineid_plot.thin_lines(x, 10.0, priority)) == [1, 3, 4]
+
+
+def test_cull_plot():
+    """Only lines within the x limits and a margin are labelled."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = np.linspace(1000, 2000, 5001)
+    line_label1 = ['L{0}'.format(i) for i in range(len(line_wave))]
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, cull=0.0, draw=False)
+    lo, hi = ax.get_xlim()
+    expected = np.sum((line_wave >= lo) & (line_wave <= hi))
+    assert len(ax.texts) == expected
+    registry = lineid_plot.get_label_registry(ax)
+    assert sorted(registry.boxes) == sorted(
+        b.get_label() for b in ax.texts)
+    plt.close(fig)
+
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, cull=True, lod_pixels=20,
+        priority=np.arange(len(line_wave)), draw=False)
+    assert 0 < len(ax.texts) <= 1.1 * ax.bbox.width / 20 + 1
+    plt.close(fig)
+
+
+def test_cull_none_and_invalid():
+    """cull=None labels every line; other values must be numbers."""
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1100.0, 1250.0, 1400.0]
+    fig, ax = lineid_plot.plot_line_ids(wave, RFLUX, line_wave,
+                                        ['A', 'B', 'C'], cull=None,
+                                        draw=False)
+    assert len(ax.texts) == 3
+    plt.close(fig)
+
+    with pytest.raises(ValueError):
+        lineid_plot.plot_line_ids(wave, RFLUX, line_wave, ['A', 'B', 'C'],
+                                  cull='yes', draw=False)
+    plt.close('all')
+
+
+def test_import_does_not_import_pyplot():
+    """Layout functions can be used without selecting a backend."""
+    import subprocess
+    import sys
+    code = (
+        "import sys, lineid_plot\n"
+        "from lineid_plot.layout import layout_labels\n"
+        "lineid_plot.adjust_boxes([1.0, 1.1], [0.5, 0.5], 0.0, 3.0)\n"
+        "lineid_plot.unique_labels(['a', 'a'])\n"
+        "layout_labels([1.0, 1.1], ['a', 'b'], (0.0, 3.0), 500.0)\n"
+        "assert 'matplotlib.pyplot' not in sys.modules\n"
+    )
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_layout_stats():
+    """Timings and layout results are reported."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    stats = lineid_plot.LayoutStats()
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1,
+                                        stats=stats)
+    assert list(stats.times) == ['prepare_lines', 'axes', 'select',
+                                 'line_flux', 'artists', 'measure', 'layout',
+                                 'place', 'draw']
+    assert stats.total > 0
+    assert stats.nlines == 7
+    assert stats.niter > 0
+    assert stats.converged
+    assert stats.overlaps == 0
+    plt.close(fig)
+
+    reported = []
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave, line_label1,
+                                        max_iter=1, stats=reported.append)
+    assert len(reported) == 1
+    assert reported[0].niter > 0
+    assert not reported[0].converged
+    assert reported[0].overlaps > 0
+    plt.close(fig)
+
+
+def test_adjust_boxes_initial():
+    """Starting from a solution, the boxes are not moved again."""
+    line_wave = np.array([1.0, 1.05, 1.1, 1.15, 3.0])
+    box_widths = np.full(5, 0.2)
+    wlp, changed, niter = lineid_plot.adjust_boxes(line_wave, box_widths,
+                                                   0.0, 5.0)
+    for backend in ('numpy', 'python'):
+        wlp2, changed2, niter2 = lineid_plot.adjust_boxes(
+            line_wave, box_widths, 0.0, 5.0, initial=wlp, backend=backend)
+        assert np.all(wlp2 == wlp)
+        assert (changed2, niter2) == (False, 5)
+    with pytest.raises(ValueError):
+        lineid_plot.adjust_boxes(line_wave, box_widths, 0.0, 5.0,
+                                 initial=wlp[:2])
+
+
+def test_previous_layout():
+    """Labels of shifted lines start from the previous layout."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = np.array([1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3,
+                          1265.35])
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+    fig, ax, previous = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, return_handle=True)
+    plt.close(fig)
+
+    cold = lineid_plot.LayoutStats()
+    warm = lineid_plot.LayoutStats()
+    fig, ax = lineid_plot.plot_line_ids(wave, flux, line_wave + 0.01,
+                                        line_label1, stats=cold)
+    plt.close(fig)
+    fig, ax, current = lineid_plot.plot_line_ids(
+        wave, flux, line_wave + 0.01, line_label1, stats=warm,
+        previous_layout=previous, return_handle=True)
+    plt.close(fig)
+
+    assert warm.niter < cold.niter
+    assert warm.overlaps == 0
+    assert np.allclose(current.positions, previous.positions + 0.01)
+
+
+def test_handle_update():
+    """Updating reuses the artists of labels that are kept."""
+    wave = 1240 + np.arange(300) * 0.1
+    flux = RFLUX
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00]
+    line_label1 = ['N V', 'Si II', 'C II', 'Fe II']
+
+    fig, ax, handle = lineid_plot.plot_line_ids(
+        wave, flux, line_wave, line_label1, return_handle=True)
+    other = ax.text(1250, 0, "other")
+    boxes = dict(zip(handle.labels, handle.boxes))
+    lines = dict(zip(handle.labels, handle.lines))
+
+    for shift in (0.1, 0.2, 0.3):
+        stats = handle.update(wave, flux * 2, [1242.80 + shift, 1265.00,
+                                               1250.00],
+                              ['N V', 'Fe II', 'O I'])
+        assert stats.overlaps == 0
+        assert len(ax.texts) == 4
+        assert len(ax.lines) == 4
+    assert other in ax.texts
+    assert handle.labels == ['N V', 'O I', 'Fe II']
+    assert handle.boxes[0] is boxes['N V']
+    assert handle.boxes[2] is boxes['Fe II']
+    assert handle.lines[2] is lines['Fe II']
+    assert boxes['Si II'] not in ax.texts
+    assert lines['Si II'] not in ax.lines
+    assert handle.boxes[0].xy[0] == 1243.10
+    assert np.all(handle.spectrum.get_ydata() == flux * 2)
+
+    registry = lineid_plot.get_label_registry(ax)
+    assert sorted(registry.boxes) == ['Fe II', 'N V', 'O I']
+    assert registry.label_sets == [handle]
+    plt.close(fig)
+
+
+def test_label_sets_kept_only_when_used():
+    """Redrawing into a cleared Axes doesn't keep the old labels."""
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74]
+    line_label1 = ['N V', 'Si II', 'C II']
+
+    fig, ax = plt.subplots()
+    for i in range(5):
+        ax.cla()
+        lineid_plot.plot_line_ids(wave, RFLUX, line_wave, line_label1,
+                                  ax=ax, draw=False)
+    registry = lineid_plot.get_label_registry(ax)
+    assert registry.label_sets == []
+    assert sum(len(b) for b in registry.boxes.values()) == 3
+
+    ax.cla()
+    _, _, handle = lineid_plot.plot_line_ids(
+        wave, RFLUX, line_wave, line_label1, ax=ax, draw=False,
+        return_handle=True)
+    assert registry.label_sets == [handle]
+    ax.cla()
+    lineid_plot.plot_line_ids(wave, RFLUX, line_wave, line_label1, ax=ax,
+                              draw=False, interactive=True)
+    assert len(registry.label_sets) == 1
+    assert registry.label_sets[0] is not handle
+    plt.close(fig)
+
+
+def test_handle_update_line_collection():
+    """Styles of the lines in a collection follow their labels."""
+    wave = 1240 + np.arange(300) * 0.1
+    fig, ax, handle = lineid_plot.plot_line_ids(
+        wave, RFLUX, [1242.80, 1260.42], ['N V', 'Si II'],
+        line_collection=True, return_handle=True)
+    handle.lines[1].set_color('r')
+
+    handle.update(wave, RFLUX, [1241.0, 1260.42], ['C IV', 'Si II'])
+    assert len(ax.collections) == 1
+    assert handle.lines[0].get_color() == mpl.colors.to_rgba('k')
+    assert handle.lines[1].get_color() == mpl.colors.to_rgba('r')
+    assert np.all(handle.lines[0].get_data()[0] == 1241.0)
+    plt.close(fig)
+
+
+def test_animated_blit():
+    """Flux changes are drawn by blitting over a cached background."""
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74]
+    line_label1 = ['N V', 'Si II', 'C II']
+
+    fig, ax, handle = lineid_plot.plot_line_ids(
+        wave, RFLUX, line_wave, line_label1, animated=True,
+        return_handle=True)
+    artists = handle.animated_artists
+    assert handle.spectrum in artists
+    assert all(line in artists for line in handle.lines)
+    assert not any(box.get_animated() for box in handle.boxes)
+
+    fig.canvas.draw()
+    assert handle._background is not None
+    changed = handle.update_flux(wave, RFLUX * 0.5)
+    assert set(changed) == set(artists)
+    assert np.allclose(handle.lines[0].get_ydata()[1],
+                       np.interp(1242.80, wave, RFLUX * 0.5))
+    positions = [b.xyann[0] for b in handle.boxes]
+    handle.blit()
+    assert [b.xyann[0] for b in handle.boxes] == positions
+
+    assert handle.set_animated(False) == []
+    assert handle._background is None
+    plt.close(fig)
+
+
+def test_animated_save_vector(tmpdir):
+    """Figures with animated labels can be saved in vector formats."""
+    wave = 1240 + np.arange(300) * 0.1
+    fig, ax = lineid_plot.plot_line_ids(
+        wave, RFLUX, [1242.80, 1260.42], ['N V', 'Si II'], animated=True)
+    for fmt in ('pdf', 'svg'):
+        fig.savefig(str(tmpdir.join('labels.' + fmt)), format=fmt)
+    plt.close(fig)
+
+
+def test_animated_pickle():
+    """Animated labels are pickled without their background."""
+    import pickle
+    wave = 1240 + np.arange(300) * 0.1
+    fig, ax, handle = lineid_plot.plot_line_ids(
+        wave, RFLUX, [1242.80, 1260.42], ['N V', 'Si II'], animated=True,
+        return_handle=True)
+    fig.canvas.draw()
+    assert handle._background is not None
+    fig2 = pickle.loads(pickle.dumps(fig))
+    plt.close(fig)
+
+    handle2 = lineid_plot.get_label_registry(fig2.axes[0]).label_sets[0]
+    assert handle2._background is None
+    handle2.update_flux(wave, RFLUX * 2)
+    handle2.blit()
+    assert handle2._background is not None
+    plt.close(fig2)
+
+
+def _crowded_groups(ngroups=20, seed=1):
+    rs = np.random.RandomState(seed=seed)
+    centers = np.arange(ngroups) * 100.0
+    line_wave = np.sort(np.concatenate(
+        [c + rs.uniform(0, 5, rs.randint(1, 8)) for c in centers]))
+    box_widths = rs.uniform(1.0, 2.0, len(line_wave))
+    return line_wave, box_widths
+
+
+def test_find_clusters():
+    line_wave = [1.0, 1.5, 10.0, 30.0, 30.2]
+    box_widths = [1.0, 1.0, 1.0, 1.0, 1.0]
+    assert lineid_plot.find_clusters(line_wave, box_widths) == \
+        [(0, 2), (2, 3), (3, 5)]
+    # Ranges of the first two groups overlap, so they are merged.
+    assert lineid_plot.find_clusters([1.0, 1.5, 4.0], box_widths[:3]) == \
+        [(0, 3)]
+    assert lineid_plot.find_clusters([], []) == []
+
+
+def test_layout_clusters_exact():
+    """Clusters give the same result as placing all boxes at once."""
+    line_wave, box_widths = _crowded_groups()
+    expected = lineid_plot.place_boxes(line_wave, box_widths, -10, 2000)
+    wlp, changed, niter = lineid_plot.layout_clusters(
+        line_wave, box_widths, -10, 2000, layout='exact')
+    assert np.allclose(wlp, expected)
+
+
+def test_layout_clusters_iterative():
+    """Boxes of different clusters don't overlap; executors are used."""
+    from concurrent.futures import ThreadPoolExecutor
+    line_wave, box_widths = _crowded_groups()
+    wlp, changed, niter = lineid_plot.layout_clusters(
+        line_wave, box_widths, -10, 2000)
+    assert not changed
+    assert np.all(np.diff(wlp) >= (box_widths[1:] + box_widths[:-1]) / 2 -
+                  1e-9)
+    with ThreadPoolExecutor(2) as executor:
+        wlp2 = lineid_plot.layout_clusters(
+            line_wave, box_widths, -10, 2000, executor=executor)[0]
+    assert np.all(wlp2 == wlp)
+    # Isolated boxes are not laid out.
+    wlp, changed, niter = lineid_plot.layout_clusters(
+        [1.0, 5.0], [1.0, 1.0], 0, 10)
+    assert list(wlp) == [1.0, 5.0]
+    assert (changed, niter) == (False, 0)
+
+
+def test_clusters_plot():
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+    stats = lineid_plot.LayoutStats()
+    fig, ax = lineid_plot.plot_line_ids(wave, RFLUX, line_wave, line_label1,
+                                        clusters=True, stats=stats)
+    assert stats.overlaps == 0
+    plt.close(fig)
+
+
+def test_plot_backend():
+    """plot_line_ids uses the given backend of adjust_boxes."""
+    pytest.importorskip("numba")
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+    positions = []
+    for backend in ('numpy', 'numba'):
+        fig, ax = lineid_plot.plot_line_ids(wave, RFLUX, line_wave,
+                                            line_label1, backend=backend)
+        positions.append([b.xyann[0] for b in ax.texts])
+        plt.close(fig)
+    assert positions[0] == positions[1]
+
+
+def test_closed_figures_are_collected():
+    """Labelled figures are freed once closed."""
+    import gc
+    import weakref
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74]
+    line_label1 = ['N V', 'Si II', 'C II']
+
+    refs = []
+    for i in range(3):
+        fig, ax = lineid_plot.plot_line_ids(wave, RFLUX, line_wave,
+                                            line_label1)
+        refs.append(weakref.ref(fig))
+        plt.close(fig)
+    del fig, ax
+    gc.collect()
+    assert [r() for r in refs] == [None, None, None]
+
+
+def test_batch_cull_different_lines():
+    """Axes that keep different lines don't share a layout."""
+    wave = np.linspace(1000, 2000, 2001)
+    flux = np.ones(len(wave))
+    line_wave = [1100.0, 1100.3, 1100.6, 1900.0, 1900.3, 1900.6]
+    line_label1 = ['Fe II'] * 6
+
+    fig = plt.figure()
+    ax1 = fig.add_axes([0.1, 0.1, 0.35, 0.6])
+    ax2 = fig.add_axes([0.55, 0.1, 0.35, 0.6])
+    for ax, lim in ((ax1, (1090, 1110)), (ax2, (1890, 1910))):
+        ax.plot(wave, flux)
+        ax.set_xlim(*lim)
+    lineid_plot.plot_line_ids_batch([(wave, flux, ax1), (wave, flux, ax2)],
+                                    line_wave, line_label1, cull=0.0)
+    for ax, lo in ((ax1, 1090), (ax2, 1890)):
+        assert len(ax.texts) == 3
+        assert all(lo < b.xyann[0] < lo + 20 for b in ax.texts)
+    plt.close(fig)
+
+
+def test_previous_layout_not_kept():
+    """A LabelSet doesn't keep the figures of earlier layouts alive."""
+    import gc
+    import weakref
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = np.array([1242.80, 1260.42, 1264.74])
+    line_label1 = ['N V', 'Si II', 'C II']
+
+    refs = []
+    previous = None
+    for i in range(3):
+        fig, ax, previous = lineid_plot.plot_line_ids(
+            wave, RFLUX, line_wave + 0.01 * i, line_label1,
+            previous_layout=previous, return_handle=True)
+        refs.append(weakref.ref(fig))
+        plt.close(fig)
+    previous.update(wave, RFLUX, line_wave, line_label1)
+    del fig, ax
+    gc.collect()
+    assert [r() is None for r in refs] == [True, True, False]
+    assert 'previous_layout' not in previous._kwargs
+
+
+def test_handle_does_not_keep_call_keywords():
+    """Stats targets and executors are used by one call only."""
+    import pickle
+    from concurrent.futures import ThreadPoolExecutor
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74]
+    line_label1 = ['N V', 'Si II', 'C II']
+
+    reports = []
+    with ThreadPoolExecutor(2) as executor:
+        fig, ax, handle = lineid_plot.plot_line_ids(
+            wave, RFLUX, line_wave, line_label1, return_handle=True,
+            stats=lambda s: reports.append(s), clusters=True,
+            executor=executor)
+    handle.update(wave, RFLUX, line_wave, line_label1)
+    handle.relayout()
+    assert len(reports) == 1
+    pickle.loads(pickle.dumps(fig))
+    plt.close(fig)
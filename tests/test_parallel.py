@@ -0,0 +1,45 @@
+"""Tests for lineid_plot.parallel."""
+import os
+
+import numpy as np
+
+from lineid_plot.parallel import render_to_files
+
+RFLUX = np.random.RandomState(seed=123).normal(size=300)
+
+
+def _jobs(tmpdir, n):
+    wave = 1240 + np.arange(300) * 0.1
+    line_wave = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+    line_label1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+    return [dict(wave=wave, flux=RFLUX, line_wave=line_wave,
+                 line_label1=line_label1,
+                 filename=os.path.join(str(tmpdir), "{0}.png".format(i)))
+            for i in range(n)]
+
+
+def test_render_to_files(tmpdir):
+    """Spectra are rendered to files and a failing job is reported."""
+    jobs = _jobs(tmpdir, 4)
+    jobs[2]['line_label1'] = ['N V']  # Not one label per line.
+
+    results = render_to_files(jobs, processes=2, chunksize=1)
+
+    assert [r.index for r in results] == [0, 1, 2, 3]
+    assert "Each line must have a label." in results[2].error
+    for i in (0, 1, 3):
+        assert results[i].error is None
+        assert results[i].seconds > 0
+        assert os.path.exists(jobs[i]['filename'])
+    assert not os.path.exists(jobs[2]['filename'])
+
+
+def test_render_to_files_in_process(tmpdir):
+    """A single process renders the jobs without a pool."""
+    jobs = _jobs(tmpdir, 2)
+    jobs[1]['savefig_kwargs'] = dict(dpi=50)
+
+    results = render_to_files(jobs, processes=1)
+
+    assert [r.error for r in results] == [None, None]
+    assert all(os.path.exists(job['filename']) for job in jobs)
@@ -0,0 +1,134 @@
+"""Tests for lineid_plot.utils."""
+import numpy as np
+from matplotlib import pyplot as plt
+
+import lineid_plot
+from lineid_plot import utils
+
+RFLUX = np.random.RandomState(seed=123).normal(size=300)
+WAVE = 1240 + np.arange(300) * 0.1
+LINE_WAVE = [1242.80, 1260.42, 1264.74, 1265.00, 1265.2, 1265.3, 1265.35]
+LINE_LABEL1 = ['N V', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II', 'Si II']
+
+
+def test_label_registry():
+    """plot_line_ids records its artists in the registry of the Axes."""
+    fig, ax = lineid_plot.plot_line_ids(
+        WAVE, RFLUX, LINE_WAVE, LINE_LABEL1, extend=[True] * 6 + [False],
+        add_label_to_artists=False)
+
+    registry = lineid_plot.get_label_registry(ax)
+    labels = lineid_plot.unique_labels(LINE_LABEL1)
+    assert sorted(registry.boxes) == sorted(labels)
+    assert sorted(registry.lines) == sorted(labels[:-1])
+    assert [registry.boxes[l][0] for l in labels] == list(ax.texts)
+    assert registry.boxes['Si II_num_2'][0].get_text() == 'Si II'
+    assert lineid_plot.get_label_registry(plt.figure().add_subplot(111)) \
+        is None
+    plt.close('all')
+
+
+def test_get_boxes_and_lines():
+    """Boxes and lines are found with and without the registry."""
+    fig, ax = lineid_plot.plot_line_ids(WAVE, RFLUX, LINE_WAVE, LINE_LABEL1)
+    labels = ['Si II', 'Si II', 'Si II']
+
+    boxes, lines = utils.get_boxes_and_lines(ax, labels)
+    assert [b.get_label() for b in boxes] == \
+        ['Si II_num_1', 'Si II_num_2', 'Si II_num_3']
+    assert [l.get_label() for l in lines] == \
+        ['Si II_num_1_line', 'Si II_num_2_line', 'Si II_num_3_line']
+
+    del ax._lineid_registry
+    assert utils.get_boxes_and_lines(ax, labels) == (boxes, lines)
+    plt.close(fig)
+
+
+def test_color_text_boxes_and_lines():
+    """Boxes and lines are colored using their labels."""
+    fig, ax = lineid_plot.plot_line_ids(WAVE, RFLUX, LINE_WAVE, LINE_LABEL1)
+    registry = lineid_plot.get_label_registry(ax)
+
+    labels = ['N V', 'Si II', 'Si II']
+    utils.color_text_boxes(ax, labels, ['red', 'blue', 'blue'])
+    utils.color_lines(ax, labels, ['green', 'blue', 'blue'])
+
+    assert registry.boxes['N V'][0].get_color() == 'red'
+    assert registry.boxes['Si II_num_2'][0].get_color() == 'blue'
+    assert registry.boxes['Si II_num_3'][0].get_color() != 'blue'
+    assert registry.lines['N V'][0].get_color() == 'green'
+    assert registry.lines['Si II_num_1'][0].get_color() == 'blue'
+    plt.close(fig)
+
+
+def test_style_labels():
+    """Many properties can be changed with a single redraw."""
+    fig, ax = lineid_plot.plot_line_ids(WAVE, RFLUX, LINE_WAVE, LINE_LABEL1)
+    registry = lineid_plot.get_label_registry(ax)
+    ndraws = []
+    fig.canvas.draw_idle = lambda *args: ndraws.append(1)
+
+    utils.style_labels(ax, LINE_LABEL1, color=['red'] + [None] * 6,
+                       fontsize=8, visible=[True, False] + [True] * 5,
+                       linecolor=(0, 0, 1), linestyle=':')
+    assert ndraws == []
+    utils.style_labels(ax, LINE_LABEL1, draw=True)
+    assert ndraws == [1]
+
+    box, line = registry.boxes['N V'][0], registry.lines['N V'][0]
+    assert box.get_color() == 'red'
+    assert box.arrow_patch.get_edgecolor()[:3] == (1, 0, 0)
+    assert registry.boxes['Si II_num_2'][0].get_color() != 'red'
+    assert box.get_fontsize() == 8
+    assert line.get_color() == (0, 0, 1)
+    assert line.get_linestyle() == ':'
+    assert not registry.boxes['Si II_num_1'][0].get_visible()
+    assert not registry.lines['Si II_num_1'][0].get_visible()
+    assert registry.boxes['Si II_num_2'][0].get_visible()
+    plt.close(fig)
+
+
+def test_style_labels_line_collection():
+    """Lines in a collection can be styled using their labels."""
+    fig, ax = lineid_plot.plot_line_ids(
+        WAVE, RFLUX, LINE_WAVE, LINE_LABEL1, line_collection=True)
+    registry = lineid_plot.get_label_registry(ax)
+    collection = ax.collections[0]
+
+    utils.style_labels(ax, LINE_LABEL1, linecolor=['red'] + [None] * 6,
+                       visible=[True, False] + [True] * 5, linewidth=2)
+    fig.canvas.draw()
+
+    assert registry.lines['N V'][0].get_color() == (1, 0, 0, 1)
+    assert not registry.lines['Si II_num_1'][0].get_visible()
+    colors = collection.get_colors()
+    assert tuple(colors[0]) == (1, 0, 0, 1)
+    assert tuple(colors[1]) == (0, 0, 0, 1)
+    segments = collection.get_segments()
+    assert len(segments[1]) == 0 and len(segments[2]) == 2
+    assert list(collection.get_linewidths()) == [2] * 7
+    plt.close(fig)
+
+
+def test_label_same_axes_twice():
+    """Artists of every call on an Axes are styled, until removed."""
+    fig, ax = lineid_plot.plot_line_ids(WAVE, RFLUX, [1245, 1250],
+                                        ['A', 'B'])
+    lineid_plot.plot_line_ids(WAVE, RFLUX, [1255, 1260], ['A', 'B'], ax=ax)
+    utils.color_text_boxes(ax, ['A', 'B'], ['r', 'g'])
+    assert [b.get_color() for b in ax.texts] == ['r', 'g', 'r', 'g']
+    boxes, lines = utils.get_boxes_and_lines(ax, ['A', 'B'])
+    assert boxes == [ax.texts[0], ax.texts[2], ax.texts[1], ax.texts[3]]
+    assert len(lines) == 4
+
+    ax.texts[0].remove()
+    boxes, lines = utils.get_boxes_and_lines(ax, ['A', 'B'])
+    assert len(boxes) == 3 and all(b.axes is ax for b in boxes)
+
+    ax.cla()
+    assert utils.get_boxes_and_lines(ax, ['A', 'B']) == ([], [])
+    lineid_plot.plot_line_ids(WAVE, RFLUX, [1245], ['A'], ax=ax)
+    registry = lineid_plot.get_label_registry(ax)
+    assert list(registry.boxes) == ['A']
+    assert registry.boxes['A'] == [ax.texts[0]]
+    plt.close(fig)